@@ -4,21 +4,160 @@ Designed for WhatsApp bot integration
 """
 
 import json
+import logging
+import math
+import mmap
 import os
 import re
+import stat
+import tempfile
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Tuple, Optional
+from operator import attrgetter
+from typing import List, Dict, Set, Tuple, Optional
 
 # Supabase support
 try:
     from supabase import create_client, Client
+    from supabase.lib.client_options import ClientOptions
     SUPABASE_AVAILABLE = True
 except ImportError:
     SUPABASE_AVAILABLE = False
 
+# orjson support (serializzazione JSON più veloce per il file locale)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+log = logging.getLogger(__name__)
+
+# Timeout (secondi) per le chiamate HTTP verso Supabase
+SUPABASE_TIMEOUT = 10
+
+# Gol massimi per squadra: risultati fuori scala porterebbero gli ELO oltre
+# i 64 bit, che orjson (file locale e dashboard) non sa serializzare
+MAX_SCORE = 99
+
+# Dopo un salvataggio Supabase fallito i tentativi successivi vengono rimandati:
+# l'attesa (secondi) raddoppia a ogni errore consecutivo fino al massimo
+SAVE_RETRY_MIN_SECONDS = 30
+SAVE_RETRY_MAX_SECONDS = 600
+
+# Regex precompilate per il parsing dei messaggi
+# Una riga della lista partecipanti: prefisso opzionale ("1.", "2)", "-", "•")
+# seguito dal nome; gli spazi ai bordi restano fuori dal gruppo catturato
+_LIST_LINE_RE = re.compile(
+    r'^[^\S\n]*(?:\d+[.)][^\S\n]*)?(?:[-•][^\S\n]*)?(.*?)[^\S\n]*$',
+    re.MULTILINE
+)
+# Punteggio: "3-2" / "3:2" ovunque nel testo ha la precedenza su "3 2";
+# con un solo match() ancorato si ottiene la stessa priorità di due search()
+_SCORE_RE = re.compile(
+    r'.*?(\d+)\s*[-:]\s*(\d+)|.*?(\d+)\s+(\d+)',
+    re.DOTALL
+)
+
+# Snake draft: posizione in classifica (mod 4) -> squadra (0 = Team 1, 1 = Team 2)
+_SNAKE_DRAFT_MASK = (0, 1, 1, 0)
+
+
+def _read_json_file(f) -> dict:
+    """Decodifica un file JSON aperto in binario (mmap + orjson se disponibile)"""
+    if not ORJSON_AVAILABLE or os.fstat(f.fileno()).st_size == 0:
+        return json.loads(f.read())
+    # orjson accetta il buffer direttamente: niente copia né decodifica UTF-8 in Python
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as view:
+            return orjson.loads(view)
+
+
+def _valid_score(team1_score: int, team2_score: int) -> bool:
+    """True se entrambi i punteggi sono tra 0 e MAX_SCORE"""
+    return 0 <= team1_score <= MAX_SCORE and 0 <= team2_score <= MAX_SCORE
+
+
+def _name_key(name: str) -> str:
+    """Chiave di confronto per i nomi: senza spazi ai bordi e case-insensitive (Unicode)"""
+    return name.strip().casefold()
+
+
+# ln(10) / 400: 10 ** (d / 400) == exp(d * _LN10_OVER_400)
+_LN10_OVER_400 = math.log(10.0) / 400.0
+
+
+def _expected_score(team_elo: float, opponent_elo: float) -> float:
+    """Punteggio atteso (formula ELO) di una squadra contro l'avversaria"""
+    return 1.0 / (1.0 + math.exp((opponent_elo - team_elo) * _LN10_OVER_400))
+
+
+def _k_factor(base_k_factor: int, elo: int, games_played: int) -> int:
+    """K-factor individuale: giocatori nuovi/deboli hanno rating più volatili"""
+    # Giocatori con poche partite hanno K più alto (rating più volatile)
+    if games_played < 10:
+        games_multiplier = 1.2
+    elif games_played < 20:
+        games_multiplier = 1.0
+    else:
+        games_multiplier = 0.85
+
+    # Giocatori con ELO basso hanno K più alto
+    if elo < 1400:
+        elo_multiplier = 1.2
+    elif elo < 1600:
+        elo_multiplier = 1.0
+    else:
+        elo_multiplier = 0.8
+
+    return int(base_k_factor * games_multiplier * elo_multiplier)
+
+
+def _performance_weight(player_elo: float, team_avg_elo: float, won: bool) -> float:
+    """
+    Peso performance basato su contributo alla squadra.
+
+    - Giocatore forte in squadra vincente → guadagna MENO (era atteso)
+    - Giocatore debole in squadra vincente → guadagna DI PIÙ (ha overperformato)
+    - Giocatore forte in squadra perdente → perde DI PIÙ (ha underperformato)
+    - Giocatore debole in squadra perdente → perde MENO (era atteso)
+    """
+    # Differenza dall'ELO medio della squadra (normalizzata)
+    diff = (player_elo - team_avg_elo) / 200  # 200 punti = 1 unità di differenza
+
+    if won:
+        # Vittoria: deboli guadagnano di più, forti di meno
+        weight = 1.0 - (diff * 0.15)  # ±15% per ogni 200 punti di differenza
+    else:
+        # Sconfitta: forti perdono di più, deboli di meno
+        weight = 1.0 + (diff * 0.15)  # ±15% per ogni 200 punti di differenza
+
+    # Limita tra 0.7 e 1.3
+    return max(0.7, min(1.3, weight))
+
+
+def _compute_elo_deltas(elos: List[int], games_played: List[int], team_avg_elo: float,
+                        result: float, expected: float, base_k_factor: int,
+                        goal_multiplier: float) -> List[float]:
+    """
+    Calcola la variazione ELO (non arrotondata) per ogni giocatore di una squadra.
+
+    Lavora solo su numeri, senza accedere agli oggetti Player, così il
+    ricalcolo dell'intero storico resta un ciclo aritmetico puro.
+    """
+    won = result == 1.0
+    base_change = result - expected
+    return [
+        _k_factor(base_k_factor, elo, games) * goal_multiplier
+        * _performance_weight(elo, team_avg_elo, won) * base_change
+        for elo, games in zip(elos, games_played)
+    ]
+
 
 class Player:
     """Represents a football player with ELO rating"""
+
+    __slots__ = ('name', 'elo', 'games_played', 'wins', 'losses')
     
     def __init__(self, name: str, initial_rating: int = 1555):
         self.name = name
@@ -51,6 +190,19 @@ class Player:
         player.wins = data['wins']
         player.losses = data['losses']
         return player
+
+    def to_tuple(self) -> tuple:
+        """Compact positional form used by the local JSON file"""
+        return (self.name, self.elo, self.games_played, self.wins, self.losses)
+
+    @classmethod
+    def from_tuple(cls, row):
+        name, elo, games_played, wins, losses = row
+        player = cls(name, elo)
+        player.games_played = games_played
+        player.wins = wins
+        player.losses = losses
+        return player
     
     def __repr__(self):
         return f"{self.name} (ELO: {self.elo})"
@@ -68,84 +220,140 @@ class TeamBalancer:
                           32 is standard for amateur players
         """
         self.players: Dict[str, Player] = {}
+        self._players_ci: Dict[str, str] = {}  # _name_key(nome) -> nome canonico
         self.base_k_factor = base_k_factor
         self.pending_games: Dict[str, dict] = {}  # game_id -> game data
+        self._removed_pending_games: Set[str] = set()  # da eliminare su Supabase al prossimo salvataggio
+        self._dirty = False  # True se ci sono modifiche non ancora salvate
+        self._save_failures = 0  # salvataggi Supabase falliti consecutivi
+        self._save_retry_at = 0.0  # time.monotonic() prima del quale non si riprova
+        self._generation = 0  # incrementato a ogni modifica dello stato
+        self._leaderboard_cache: Dict[int, str] = {}  # limit -> testo classifica
+        self._leaderboard_cache_gen = -1
+        self._ranked: List[Player] = []  # giocatori per ELO decrescente
+        self._ranked_gen = -1
 
         # Supabase setup
         self.supabase: Optional[Client] = None
         self._init_supabase()
 
-    def _get_player_k_factor(self, player: Player) -> int:
-        """
-        Calcola K-factor individuale basato su ELO e partite giocate.
-        Giocatori nuovi/deboli hanno rating più volatili.
+    def _apply_elo_update(self, players: List[Player], result: float, expected: float,
+                          team_avg_elo: float, goal_multiplier: float,
+                          rating_changes: Optional[List[str]] = None,
+                          elo_changes: Optional[Dict[str, dict]] = None):
         """
-        # Giocatori con poche partite hanno K più alto (rating più volatile)
-        if player.games_played < 10:
-            games_multiplier = 1.2
-        elif player.games_played < 20:
-            games_multiplier = 1.0
-        else:
-            games_multiplier = 0.85
+        Applica l'aggiornamento ELO ai giocatori di una squadra.
 
-        # Giocatori con ELO basso hanno K più alto
-        if player.elo < 1400:
-            elo_multiplier = 1.2
-        elif player.elo < 1600:
-            elo_multiplier = 1.0
-        else:
-            elo_multiplier = 0.8
+        Args:
+            players: Giocatori della squadra
+            result: Esito per la squadra (1.0 vittoria, 0.5 pareggio, 0.0 sconfitta)
+            expected: Punteggio atteso della squadra secondo la formula ELO
+            team_avg_elo: ELO medio della squadra prima della partita
+            goal_multiplier: Moltiplicatore per differenza gol
+            rating_changes: Se fornita, riceve una riga di testo per giocatore
+            elo_changes: Se fornito, riceve lo snapshot pre-partita di ogni giocatore
+        """
+        won = result == 1.0
+        lost = result == 0.0
+        drew = result == 0.5
+
+        # Snapshot pre-partita: ogni attributo viene letto una sola volta
+        elos = [p.elo for p in players]
+        games = [p.games_played for p in players]
+        deltas = _compute_elo_deltas(
+            elos, games, team_avg_elo, result, expected, self.base_k_factor, goal_multiplier
+        )
 
-        return int(self.base_k_factor * games_multiplier * elo_multiplier)
+        for player, old_elo, old_games, change in zip(players, elos, games, deltas):
+            old_wins = player.wins
+            old_losses = player.losses
+            new_elo = int(old_elo + change)
+            player.elo = new_elo
+            player.games_played = old_games + 1
+            if won:
+                player.wins = old_wins + 1
+            elif lost:
+                player.losses = old_losses + 1
+
+            if rating_changes is not None:
+                rating_changes.append(f"  {player.name}: {old_elo} → {new_elo} ({change:+.0f})")
+            if elo_changes is not None:
+                elo_changes[player.name] = {
+                    'elo_before': old_elo, 'elo_after': new_elo,
+                    'games_before': old_games, 'wins_before': old_wins, 'losses_before': old_losses,
+                    'won': won, 'drew': drew
+                }
 
-    def _get_performance_weight(self, player_elo: int, team_avg_elo: int, won: bool) -> float:
+    def _apply_game_result(self, team1_players: List[Player], team2_players: List[Player],
+                           team1_score: int, team2_score: int,
+                           rating_changes: Optional[List[str]] = None,
+                           elo_changes: Optional[Dict[str, dict]] = None) -> Tuple[float, float]:
         """
-        Calcola peso performance basato su contributo alla squadra.
+        Aggiorna i rating di entrambe le squadre in base al risultato.
 
-        - Giocatore forte in squadra vincente → guadagna MENO (era atteso)
-        - Giocatore debole in squadra vincente → guadagna DI PIÙ (ha overperformato)
-        - Giocatore forte in squadra perdente → perde DI PIÙ (ha underperformato)
-        - Giocatore debole in squadra perdente → perde MENO (era atteso)
+        Returns:
+            (team1_avg_elo, team2_avg_elo) calcolati prima dell'aggiornamento
         """
-        # Differenza dall'ELO medio della squadra (normalizzata)
-        diff = (player_elo - team_avg_elo) / 200  # 200 punti = 1 unità di differenza
-
-        if won:
-            # Vittoria: deboli guadagnano di più, forti di meno
-            weight = 1.0 - (diff * 0.15)  # ±15% per ogni 200 punti di differenza
+        # Esito per il Team 1 (1.0 vittoria, 0.5 pareggio, 0.0 sconfitta)
+        if team1_score > team2_score:
+            team1_result = 1.0
+        elif team2_score > team1_score:
+            team1_result = 0.0
         else:
-            # Sconfitta: forti perdono di più, deboli di meno
-            weight = 1.0 + (diff * 0.15)  # ±15% per ogni 200 punti di differenza
+            team1_result = 0.5
+
+        team1_avg_elo = sum(p.elo for p in team1_players) / len(team1_players)
+        team2_avg_elo = sum(p.elo for p in team2_players) / len(team2_players)
 
-        # Limita tra 0.7 e 1.3
-        return max(0.7, min(1.3, weight))
+        # Expected score con formula ELO (le due aspettative sommano a 1)
+        expected1 = _expected_score(team1_avg_elo, team2_avg_elo)
+
+        # Goal difference multiplier (bigger wins = bigger rating changes)
+        goal_diff = abs(team1_score - team2_score)
+        goal_multiplier = 1 + (goal_diff - 1) * 0.1  # +10% per goal difference
+
+        # Un solo passaggio per squadra, Team 1 per primo (ordine di rating_changes)
+        for players, result, expected, team_avg_elo in (
+            (team1_players, team1_result, expected1, team1_avg_elo),
+            (team2_players, 1.0 - team1_result, 1.0 - expected1, team2_avg_elo),
+        ):
+            self._apply_elo_update(players, result, expected, team_avg_elo,
+                                   goal_multiplier, rating_changes, elo_changes)
+        # Invalidazione dopo aver scritto entrambe le squadre: chi ricalcola la
+        # classifica a metà aggiornamento non la lascia in cache come attuale
+        self._mark_changed()
+
+        return team1_avg_elo, team2_avg_elo
 
     def _init_supabase(self):
         """Inizializza connessione Supabase se disponibile"""
-        print(f"🔧 Inizializzazione Supabase...")
-        print(f"   SUPABASE_AVAILABLE: {SUPABASE_AVAILABLE}")
+        log.debug("Inizializzazione Supabase (modulo disponibile: %s)", SUPABASE_AVAILABLE)
 
         if not SUPABASE_AVAILABLE:
-            print("⚠️ Supabase non disponibile (modulo non installato), uso file locale")
+            log.info("Supabase non disponibile (modulo non installato), uso file locale")
             return
 
         supabase_url = os.environ.get('SUPABASE_URL')
         supabase_key = os.environ.get('SUPABASE_KEY')
 
-        print(f"   SUPABASE_URL configurato: {supabase_url is not None}")
-        print(f"   SUPABASE_KEY configurato: {supabase_key is not None}")
+        log.debug("SUPABASE_URL configurato: %s, SUPABASE_KEY configurato: %s",
+                  supabase_url is not None, supabase_key is not None)
 
         if supabase_url and supabase_key:
             try:
-                self.supabase = create_client(supabase_url, supabase_key)
-                print(f"✅ Connesso a Supabase: {supabase_url}")
-            except Exception as e:
-                print(f"⚠️ Errore connessione Supabase: {e}")
-                import traceback
-                traceback.print_exc()
+                # Un solo client per istanza: la sessione HTTP (keep-alive)
+                # viene riutilizzata da tutte le chiamate .table(...)
+                options = ClientOptions(
+                    postgrest_client_timeout=SUPABASE_TIMEOUT,
+                    storage_client_timeout=SUPABASE_TIMEOUT
+                )
+                self.supabase = create_client(supabase_url, supabase_key, options=options)
+                log.info("Connesso a Supabase: %s", supabase_url)
+            except Exception:
+                log.exception("Errore connessione Supabase")
                 self.supabase = None
         else:
-            print("⚠️ Credenziali Supabase non configurate, uso file locale")
+            log.info("Credenziali Supabase non configurate, uso file locale")
     
     def add_player(self, name: str, initial_vote: int) -> str:
         """Add a new player with initial 1-10 vote"""
@@ -153,10 +361,13 @@ class TeamBalancer:
             return f"❌ Vote must be between 1-10, got {initial_vote}"
         
         name = name.strip()
-        if name.lower() in [p.lower() for p in self.players.keys()]:
+        key = _name_key(name)
+        if key in self._players_ci:
             return f"❌ Player '{name}' already exists"
         
         self.players[name] = Player.from_vote(name, initial_vote)
+        self._players_ci[key] = name
+        self._mark_changed()
         return f"✅ Added {name} with initial rating {initial_vote}/10 (ELO: {self.players[name].elo})"
 
     def remove_player(self, name: str) -> str:
@@ -168,6 +379,8 @@ class TeamBalancer:
         # Trova il nome esatto (case-sensitive) per la rimozione
         actual_name = player.name
         del self.players[actual_name]
+        self._players_ci.pop(_name_key(actual_name), None)
+        self._mark_changed()
         # Elimina anche da Supabase
         self._delete_player_from_supabase(actual_name)
         return f"✅ Giocatore '{actual_name}' rimosso"
@@ -180,19 +393,17 @@ class TeamBalancer:
         - "John\nMike\nSarah\n..."
         - "1. John\n2. Mike\n..."
         """
-        # Remove numbers and common prefixes
-        message = re.sub(r'^\d+[\.\)]\s*', '', message, flags=re.MULTILINE)
-        message = re.sub(r'^[-•]\s*', '', message, flags=re.MULTILINE)
-        
-        # Split by newlines or commas
         if '\n' in message:
-            names = [line.strip() for line in message.split('\n')]
+            # Un nome per riga: prefissi ("1.", "2)", "-", "•") e spazi
+            # vengono rimossi nello stesso passaggio della regex
+            names = _LIST_LINE_RE.findall(message)
         else:
-            names = [name.strip() for name in message.split(',')]
+            # Separati da virgola: rimuovi l'eventuale prefisso iniziale
+            line = _LIST_LINE_RE.match(message).group(1)
+            names = [name.strip() for name in line.split(',')]
         
-        # Clean and filter
-        names = [name for name in names if name and len(name) > 0]
-        return names
+        # Filter empty entries
+        return [name for name in names if name]
     
     def propose_teams(self, participant_names: List[str]) -> Tuple[Optional[dict], str]:
         """
@@ -218,20 +429,21 @@ class TeamBalancer:
         if missing:
             return None, f"❌ Unknown players: {', '.join(missing)}\nPlease add them first with their ratings."
 
-        # Balance teams using snake draft
-        participants.sort(key=lambda p: p.elo, reverse=True)
+        # Balance teams using snake draft (1-2-2-1 pattern over ELO ranking)
+        participants.sort(key=attrgetter('elo'), reverse=True)
 
         team1 = []
         team2 = []
+        team_lists = (team1, team2)
+        elo_sums = [0, 0]
 
         for i, player in enumerate(participants):
-            if i % 4 == 0 or i % 4 == 3:
-                team1.append(player)
-            else:
-                team2.append(player)
+            side = _SNAKE_DRAFT_MASK[i & 3]
+            team_lists[side].append(player)
+            elo_sums[side] += player.elo
 
-        team1_avg = sum(p.elo for p in team1) / len(team1)
-        team2_avg = sum(p.elo for p in team2) / len(team2)
+        team1_avg = elo_sums[0] / len(team1)
+        team2_avg = elo_sums[1] / len(team2)
 
         teams = {
             'team1': [p.name for p in team1],
@@ -246,7 +458,8 @@ class TeamBalancer:
         """
         Confirm proposed teams and create a pending game.
         """
-        game_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        now = datetime.now()
+        game_id = now.strftime("%Y%m%d_%H%M%S")
 
         team1_avg = sum(self.players[n].elo for n in team1 if n in self.players) / len(team1)
         team2_avg = sum(self.players[n].elo for n in team2 if n in self.players) / len(team2)
@@ -257,10 +470,12 @@ class TeamBalancer:
             'team2': team2,
             'team1_avg_elo': round(team1_avg),
             'team2_avg_elo': round(team2_avg),
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now.isoformat(),
+            'display_ts': now.strftime('%Y-%m-%d %H:%M')
         }
 
         self.pending_games[game_id] = teams
+        self._mark_changed()
         return teams, "✅ Partita creata"
 
     def create_teams(self, participant_names: List[str]) -> Tuple[Optional[dict], str]:
@@ -279,35 +494,37 @@ class TeamBalancer:
             return None, confirm_msg
 
         # Format message for WhatsApp
-        message = "⚽ *TEAMS CREATED*\n\n"
-        message += f"🔵 *Team 1* (Avg ELO: {confirmed['team1_avg_elo']})\n"
-        for name in confirmed['team1']:
-            p = self._find_player(name)
-            message += f"  • {name} ({p.elo if p else '?'})\n"
-        message += f"\n🔴 *Team 2* (Avg ELO: {confirmed['team2_avg_elo']})\n"
-        for name in confirmed['team2']:
-            p = self._find_player(name)
-            message += f"  • {name} ({p.elo if p else '?'})\n"
-        message += f"\n_Game ID: {confirmed['game_id']}_"
+        team1_lines = self._format_team_lines(confirmed['team1'])
+        team2_lines = self._format_team_lines(confirmed['team2'])
+        message = (
+            "⚽ *TEAMS CREATED*\n\n"
+            f"🔵 *Team 1* (Avg ELO: {confirmed['team1_avg_elo']})\n{team1_lines}\n"
+            f"\n🔴 *Team 2* (Avg ELO: {confirmed['team2_avg_elo']})\n{team2_lines}\n"
+            f"\n_Game ID: {confirmed['game_id']}_"
+        )
 
         return confirmed, message
+
+    def _format_team_lines(self, names: List[str]) -> str:
+        """One '  • name (elo)' line per player, joined with newlines"""
+        players = self.players
+        return "\n".join(
+            f"  • {name} ({players[name].elo if name in players else '?'})" for name in names
+        )
     
     def parse_score(self, message: str) -> Optional[Tuple[int, int]]:
         """
         Parse score from message
-        Handles: "3-2", "3 2", "team1: 3, team2: 2", etc.
+        Handles: "3-2", "3:2", "3 2", "team1: 3, team2: 2", etc.
         """
-        # Try hyphen format: "3-2"
-        match = re.search(r'(\d+)\s*[-:]\s*(\d+)', message)
-        if match:
-            return int(match.group(1)), int(match.group(2))
-        
-        # Try space format: "3 2"
-        match = re.search(r'(\d+)\s+(\d+)', message)
-        if match:
-            return int(match.group(1)), int(match.group(2))
-        
-        return None
+        match = _SCORE_RE.match(message)
+        if not match:
+            return None
+        if match.group(1) is not None:
+            score = int(match.group(1)), int(match.group(2))
+        else:
+            score = int(match.group(3)), int(match.group(4))
+        return score if _valid_score(*score) else None
     
     def update_ratings(self, game_id: str, team1_score: int, team2_score: int) -> str:
         """
@@ -320,92 +537,30 @@ class TeamBalancer:
         """
         if game_id not in self.pending_games:
             return f"❌ Game {game_id} not found"
+        if not _valid_score(team1_score, team2_score):
+            return f"❌ Scores must be between 0 and {MAX_SCORE}"
         
         game = self.pending_games[game_id]
         
         # Determine outcome
         if team1_score > team2_score:
-            team1_result = 1.0
-            team2_result = 0.0
             winner = "Team 1"
         elif team2_score > team1_score:
-            team1_result = 0.0
-            team2_result = 1.0
             winner = "Team 2"
         else:
-            team1_result = 0.5
-            team2_result = 0.5
             winner = "Draw"
         
         # Get players
         team1_players = [self.players[name] for name in game['team1']]
         team2_players = [self.players[name] for name in game['team2']]
         
-        # Calculate average ELOs
-        team1_avg_elo = sum(p.elo for p in team1_players) / len(team1_players)
-        team2_avg_elo = sum(p.elo for p in team2_players) / len(team2_players)
-        
-        # Expected scores using ELO formula
-        expected1 = 1 / (1 + 10 ** ((team2_avg_elo - team1_avg_elo) / 400))
-        expected2 = 1 / (1 + 10 ** ((team1_avg_elo - team2_avg_elo) / 400))
-        
-        # Goal difference multiplier (bigger wins = bigger rating changes)
-        goal_diff = abs(team1_score - team2_score)
-        goal_multiplier = 1 + (goal_diff - 1) * 0.1  # +10% per goal difference
-
         # Update ratings with individual K-factor and performance weighting
         rating_changes = []
         elo_changes = {}
-
-        for player in team1_players:
-            old_elo = player.elo
-            old_games = player.games_played
-            old_wins = player.wins
-            old_losses = player.losses
-            # K-factor individuale
-            k = self._get_player_k_factor(player)
-            # Peso performance (forte in squadra perdente perde di più, etc.)
-            perf_weight = self._get_performance_weight(player.elo, team1_avg_elo, team1_result == 1.0)
-            # Calcolo cambio rating
-            base_change = (team1_result - expected1)
-            change = k * goal_multiplier * perf_weight * base_change
-            player.elo = int(player.elo + change)
-            player.games_played += 1
-            if team1_result == 1.0:
-                player.wins += 1
-            elif team1_result == 0.0:
-                player.losses += 1
-            rating_changes.append(f"  {player.name}: {old_elo} → {player.elo} ({change:+.0f})")
-            elo_changes[player.name] = {
-                'elo_before': old_elo, 'elo_after': player.elo,
-                'games_before': old_games, 'wins_before': old_wins, 'losses_before': old_losses,
-                'won': team1_result == 1.0, 'drew': team1_result == 0.5
-            }
-
-        for player in team2_players:
-            old_elo = player.elo
-            old_games = player.games_played
-            old_wins = player.wins
-            old_losses = player.losses
-            # K-factor individuale
-            k = self._get_player_k_factor(player)
-            # Peso performance
-            perf_weight = self._get_performance_weight(player.elo, team2_avg_elo, team2_result == 1.0)
-            # Calcolo cambio rating
-            base_change = (team2_result - expected2)
-            change = k * goal_multiplier * perf_weight * base_change
-            player.elo = int(player.elo + change)
-            player.games_played += 1
-            if team2_result == 1.0:
-                player.wins += 1
-            elif team2_result == 0.0:
-                player.losses += 1
-            rating_changes.append(f"  {player.name}: {old_elo} → {player.elo} ({change:+.0f})")
-            elo_changes[player.name] = {
-                'elo_before': old_elo, 'elo_after': player.elo,
-                'games_before': old_games, 'wins_before': old_wins, 'losses_before': old_losses,
-                'won': team2_result == 1.0, 'drew': team2_result == 0.5
-            }
+        team1_avg_elo, team2_avg_elo = self._apply_game_result(
+            team1_players, team2_players, team1_score, team2_score,
+            rating_changes, elo_changes
+        )
 
         # Salva nello storico partite
         self._save_game_history(
@@ -421,131 +576,249 @@ class TeamBalancer:
         )
 
         # Remove from pending
-        del self.pending_games[game_id]
+        self._remove_pending_game(game_id)
 
         # Format message
-        message = f"📊 *RISULTATO REGISTRATO*\n\n"
-        message += f"🔵 Team 1: {team1_score}\n"
-        message += f"🔴 Team 2: {team2_score}\n"
-        message += f"🏆 Vincitore: {winner}\n\n"
-        message += f"*Cambi di Rating:*\n"
-        message += "\n".join(rating_changes)
-
-        return message
+        parts = [
+            "📊 *RISULTATO REGISTRATO*\n\n",
+            f"🔵 Team 1: {team1_score}\n",
+            f"🔴 Team 2: {team2_score}\n",
+            f"🏆 Vincitore: {winner}\n\n",
+            "*Cambi di Rating:*\n",
+            "\n".join(rating_changes),
+        ]
+
+        return ''.join(parts)
     
     def get_leaderboard(self, limit: int = 10) -> str:
-        """Get top players by ELO"""
+        """Get top players by ELO (cached until the next state change)"""
+        if self._leaderboard_cache_gen != self._generation:
+            self._leaderboard_cache.clear()
+            self._leaderboard_cache_gen = self._generation
+        cached = self._leaderboard_cache.get(limit)
+        if cached is None:
+            cached = self._leaderboard_cache[limit] = self._build_leaderboard(limit)
+        return cached
+
+    def _build_leaderboard(self, limit: int) -> str:
         if not self.players:
             return "No players yet!"
         
-        sorted_players = sorted(self.players.values(), key=lambda p: p.elo, reverse=True)
+        top_players = self._ranked_players()[:limit]
         
-        message = f"🏆 *TOP {min(limit, len(sorted_players))} PLAYERS*\n\n"
-        for i, player in enumerate(sorted_players[:limit], 1):
-            win_rate = (player.wins / player.games_played * 100) if player.games_played > 0 else 0
-            message += f"{i}. {player.name}\n"
-            message += f"   ELO: {player.elo} | Games: {player.games_played} | Win Rate: {win_rate:.1f}%\n"
+        parts = [f"🏆 *TOP {len(top_players)} PLAYERS*\n\n"]
+        for i, player in enumerate(top_players, 1):
+            games_played = player.games_played
+            win_rate = (player.wins / games_played * 100) if games_played > 0 else 0
+            parts.append(f"{i}. {player.name}\n")
+            parts.append(f"   ELO: {player.elo} | Games: {games_played} | Win Rate: {win_rate:.1f}%\n")
         
-        return message
+        return ''.join(parts)
     
     def get_pending_games(self) -> str:
         """Get list of games waiting for scores"""
         if not self.pending_games:
             return "No pending games"
         
-        message = "⏳ *PENDING GAMES*\n\n"
+        parts = ["⏳ *PENDING GAMES*\n\n"]
         for game_id, game in self.pending_games.items():
-            timestamp = datetime.fromisoformat(game['timestamp'])
-            message += f"Game {game_id}\n"
-            message += f"Created: {timestamp.strftime('%Y-%m-%d %H:%M')}\n"
-            message += f"Team 1: {', '.join(game['team1'][:3])}...\n"
-            message += f"Team 2: {', '.join(game['team2'][:3])}...\n\n"
+            display_ts = game.get('display_ts')
+            if display_ts is None:
+                # Partite salvate prima dell'introduzione di display_ts
+                display_ts = datetime.fromisoformat(game['timestamp']).strftime('%Y-%m-%d %H:%M')
+            parts.append(f"Game {game_id}\n")
+            parts.append(f"Created: {display_ts}\n")
+            parts.append(f"Team 1: {', '.join(game['team1'][:3])}...\n")
+            parts.append(f"Team 2: {', '.join(game['team2'][:3])}...\n\n")
         
-        return message
+        return ''.join(parts)
     
     def _find_player(self, name: str) -> Optional[Player]:
         """Find player by name (case-insensitive)"""
-        for player_name, player in self.players.items():
-            if player_name.lower() == name.lower():
-                return player
-        return None
+        canonical = self._players_ci.get(_name_key(name))
+        return self.players.get(canonical) if canonical else None
+
+    @property
+    def generation(self) -> int:
+        """Contatore incrementato a ogni modifica dello stato (utile per cache ed ETag)"""
+        return self._generation
+
+    def _ranked_players(self) -> List[Player]:
+        """Giocatori ordinati per ELO decrescente (riordinati solo dopo una modifica)"""
+        if self._ranked_gen != self._generation:
+            self._ranked = sorted(self.players.values(), key=attrgetter('elo'), reverse=True)
+            self._ranked_gen = self._generation
+        return self._ranked
+
+    def _invalidate_caches(self):
+        """Invalida classifica e risposte in cache (es. dopo un caricamento, senza salvare)"""
+        self._generation += 1
+
+    def _mark_changed(self):
+        """Segna lo stato come modificato: da salvare e con cache da invalidare"""
+        self._dirty = True
+        self._invalidate_caches()
+
+    def _remove_pending_game(self, game_id: str):
+        """Rimuove una partita in attesa e la segna per l'eliminazione su Supabase"""
+        del self.pending_games[game_id]
+        if self.supabase:
+            # In modalità file locale il file viene riscritto per intero
+            self._removed_pending_games.add(game_id)
+        self._mark_changed()
+
+    def _rebuild_player_index(self):
+        """Ricostruisce l'indice chiave normalizzata -> nome canonico"""
+        self._players_ci = {_name_key(name): name for name in self.players}
     
-    def save_to_file(self, filename: str = 'football_data.json'):
-        """Salva dati su Supabase o file locale"""
-        print(f"📝 Salvataggio dati... (Supabase: {self.supabase is not None})")
-        print(f"   Giocatori: {len(self.players)}, Partite in attesa: {len(self.pending_games)}")
+    def save_to_file(self, filename: str = 'football_data.json', force: bool = False):
+        """Salva dati su Supabase o file locale (nessuna scrittura se non ci sono modifiche)
+
+        Dopo un errore di Supabase i salvataggi vengono saltati fino allo scadere
+        dell'attesa, salvo con force=True (es. alla chiusura del processo).
+        """
+        if not self._dirty:
+            log.debug("Nessuna modifica da salvare")
+            return
+        if not force and time.monotonic() < self._save_retry_at:
+            log.debug("Salvataggio rimandato dopo un errore Supabase")
+            return
+        log.debug("Salvataggio dati (Supabase: %s): %d giocatori, %d partite in attesa",
+                  self.supabase is not None, len(self.players), len(self.pending_games))
         if self.supabase:
-            self._save_to_supabase()
+            saved = self._save_to_supabase()
         else:
             self._save_to_local_file(filename)
+            saved = True
+        if saved:
+            self._dirty = False
+            if self._save_failures:
+                log.info("Salvataggio Supabase riuscito dopo %d tentativi falliti",
+                         self._save_failures)
+            self._save_failures = 0
+            self._save_retry_at = 0.0
+        else:
+            self._save_failures += 1
+            delay = min(SAVE_RETRY_MIN_SECONDS * 2 ** (self._save_failures - 1),
+                        SAVE_RETRY_MAX_SECONDS)
+            self._save_retry_at = time.monotonic() + delay
+            log.debug("Prossimo tentativo di salvataggio Supabase tra %d secondi", delay)
 
     def _save_to_local_file(self, filename: str = 'football_data.json'):
         """Salva dati su file JSON locale"""
         data = {
-            'players': {name: player.to_dict() for name, player in self.players.items()},
+            # [nome, elo, partite, vittorie, sconfitte] per giocatore
+            'players': [player.to_tuple() for player in self.players.values()],
             'pending_games': self.pending_games,
             'k_factor': self.base_k_factor
         }
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2)
-
-    def _save_to_supabase(self):
-        """Salva dati su Supabase"""
+        payload = None
+        if ORJSON_AVAILABLE:
+            try:
+                payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+            except TypeError:
+                # orjson rifiuta gli interi oltre i 64 bit, json li accetta
+                log.warning("orjson non riesce a serializzare i dati, uso json")
+        if payload is None:
+            payload = json.dumps(data, indent=2).encode('utf-8')
+
+        # Scrittura atomica: file temporaneo nella stessa cartella + os.replace,
+        # così un crash a metà scrittura non lascia un file corrotto
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.football_data_', suffix='.tmp')
         try:
-            # Salva giocatori
-            for name, player in self.players.items():
-                player_data = player.to_dict()
-                print(f"   Salvando giocatore: {name}")
-                # Upsert: inserisce o aggiorna
-                result = self.supabase.table('players').upsert(
-                    player_data,
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp crea il file con permessi 0600: si mantengono quelli del
+            # file esistente (o 0644 per uno nuovo) così restano leggibili per backup
+            try:
+                mode = stat.S_IMODE(os.stat(filename).st_mode)
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, filename)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _save_to_supabase(self) -> bool:
+        """Salva dati su Supabase. Restituisce False se è stato usato il fallback locale"""
+        try:
+            # Salva giocatori con un unico upsert (inserisce o aggiorna)
+            player_rows = [player.to_dict() for player in self.players.values()]
+            if player_rows:
+                self.supabase.table('players').upsert(
+                    player_rows,
                     on_conflict='name'
                 ).execute()
-                print(f"   Risultato: {result}")
-
-            # Salva partite in attesa
-            print(f"   Salvando {len(self.pending_games)} partite in attesa...")
-            # Prima elimina tutte le partite esistenti, poi reinserisce
-            self.supabase.table('pending_games').delete().neq('game_id', '').execute()
-            for game_id, game_data in self.pending_games.items():
-                print(f"   Salvando partita: {game_id}")
-                result = self.supabase.table('pending_games').insert({
-                    'game_id': game_id,
-                    'data': json.dumps(game_data)
-                }).execute()
-                print(f"   Risultato: {result}")
 
-            print("✅ Dati salvati su Supabase")
+            # Salva partite in attesa: la colonna `data` è jsonb, quindi i dict
+            # vengono inviati così come sono. Si eliminano solo le partite
+            # chiuse o cancellate, le altre vengono aggiornate con un upsert.
+            if self._removed_pending_games:
+                self.supabase.table('pending_games').delete().in_(
+                    'game_id', list(self._removed_pending_games)
+                ).execute()
+                self._removed_pending_games.clear()
+            game_rows = [
+                {'game_id': game_id, 'data': game_data}
+                for game_id, game_data in self.pending_games.items()
+            ]
+            if game_rows:
+                self.supabase.table('pending_games').upsert(
+                    game_rows,
+                    on_conflict='game_id'
+                ).execute()
+
+            log.debug("Dati salvati su Supabase: %d giocatori, %d partite in attesa",
+                      len(player_rows), len(game_rows))
+            return True
 
         except Exception as e:
-            print(f"❌ Errore salvataggio Supabase: {e}")
-            import traceback
-            traceback.print_exc()
+            # Traccia completa solo al primo errore: finché Supabase non torna
+            # raggiungibile i tentativi successivi non riempiono il log
+            if self._save_failures == 0:
+                log.exception("Errore salvataggio Supabase, uso file locale e riprovo più tardi")
+            else:
+                log.debug("Salvataggio Supabase ancora non riuscito: %s", e)
             # Fallback su file locale
             self._save_to_local_file()
+            return False
 
     def load_from_file(self, filename: str = 'football_data.json'):
         """Carica dati da Supabase o file locale"""
-        print(f"📂 Caricamento dati... (Supabase: {self.supabase is not None})")
+        log.debug("Caricamento dati (Supabase: %s)", self.supabase is not None)
         if self.supabase:
             result = self._load_from_supabase()
-            print(f"   Caricati da Supabase: {len(self.players)} giocatori, {len(self.pending_games)} partite")
+            log.info("Caricati da Supabase: %d giocatori, %d partite in attesa",
+                     len(self.players), len(self.pending_games))
             return result
         else:
             result = self._load_from_local_file(filename)
-            print(f"   Caricati da file locale: {len(self.players)} giocatori, {len(self.pending_games)} partite")
+            log.info("Caricati da file locale: %d giocatori, %d partite in attesa",
+                     len(self.players), len(self.pending_games))
             return result
 
     def _load_from_local_file(self, filename: str = 'football_data.json'):
         """Carica dati da file JSON locale"""
         try:
-            with open(filename, 'r') as f:
-                data = json.load(f)
-
-            self.players = {name: Player.from_dict(pdata)
-                          for name, pdata in data['players'].items()}
+            with open(filename, 'rb') as f:
+                data = _read_json_file(f)
+
+            players = data['players']
+            if isinstance(players, dict):
+                # Formato precedente: {nome: {campi del giocatore}}
+                self.players = {name: Player.from_dict(pdata)
+                                for name, pdata in players.items()}
+            else:
+                self.players = {row[0]: Player.from_tuple(row) for row in players}
             self.pending_games = data.get('pending_games', {})
-            self.base_k_factor = data.get('k_factor', 32)
+            self.base_k_factor = data.get('k_factor', self.base_k_factor)
+            self._rebuild_player_index()
+            self._invalidate_caches()
+            self._dirty = False
             return True
         except FileNotFoundError:
             return False
@@ -559,18 +832,25 @@ class TeamBalancer:
             for row in result.data:
                 player = Player.from_dict(row)
                 self.players[player.name] = player
+            self._rebuild_player_index()
 
             # Carica partite in attesa
             result = self.supabase.table('pending_games').select('*').execute()
             self.pending_games = {}
+            self._removed_pending_games.clear()
             for row in result.data:
-                self.pending_games[row['game_id']] = json.loads(row['data'])
+                game_data = row['data']
+                # Righe salvate prima della migrazione a jsonb contengono testo JSON
+                if isinstance(game_data, str):
+                    game_data = json.loads(game_data)
+                self.pending_games[row['game_id']] = game_data
+            self._invalidate_caches()
+            self._dirty = False
 
-            print(f"✅ Caricati {len(self.players)} giocatori da Supabase")
             return True
 
         except Exception as e:
-            print(f"Errore caricamento Supabase: {e}")
+            log.error("Errore caricamento Supabase: %s", e)
             # Fallback su file locale
             return self._load_from_local_file()
 
@@ -579,8 +859,8 @@ class TeamBalancer:
         if self.supabase:
             try:
                 self.supabase.table('players').delete().eq('name', name).execute()
-            except Exception as e:
-                print(f"Errore eliminazione da Supabase: {e}")
+            except Exception:
+                log.exception("Errore eliminazione giocatore %s da Supabase", name)
 
     def _save_game_history(self, game_id: str, team1: list, team2: list,
                           team1_score: int, team2_score: int,
@@ -602,15 +882,18 @@ class TeamBalancer:
                 if elo_changes:
                     record['elo_changes'] = elo_changes
                 self.supabase.table('game_history').insert(record).execute()
-                print(f"✅ Partita {game_id} salvata nello storico")
-            except Exception as e:
-                print(f"❌ Errore salvataggio storico partita: {e}")
+                log.info("Partita %s salvata nello storico", game_id)
+            except Exception:
+                log.exception("Errore salvataggio storico partita %s", game_id)
+
+    def get_top_players(self, limit: int = 5) -> List[Player]:
+        """Return the top players by ELO (sorted once per state change)"""
+        return self._ranked_players()[:limit]
 
     def get_players_data(self) -> list:
         """Return all players as list of dicts, sorted by ELO descending"""
-        sorted_players = sorted(self.players.values(), key=lambda p: p.elo, reverse=True)
         result = []
-        for i, player in enumerate(sorted_players, 1):
+        for i, player in enumerate(self._ranked_players(), 1):
             win_rate = (player.wins / player.games_played * 100) if player.games_played > 0 else 0
             d = player.to_dict()
             d['rank'] = i
@@ -627,8 +910,8 @@ class TeamBalancer:
                 'played_at', desc=True
             ).limit(limit).execute()
             return result.data if result.data else []
-        except Exception as e:
-            print(f"Error reading game history: {e}")
+        except Exception:
+            log.exception("Errore lettura storico")
             return []
 
     def get_pending_games_data(self) -> list:
@@ -655,8 +938,8 @@ class TeamBalancer:
                 'played_at', desc=False
             ).execute()
             all_games = all_history.data if all_history.data else []
-        except Exception as e:
-            print(f"Errore lettura storico: {e}")
+        except Exception:
+            log.exception("Errore lettura storico")
             return "❌ Errore nel recupero dello storico"
 
         # Reset all players to starting ELO
@@ -665,6 +948,7 @@ class TeamBalancer:
             player.games_played = 0
             player.wins = 0
             player.losses = 0
+        self._mark_changed()
 
         # Replay every game in chronological order
         for g in all_games:
@@ -676,7 +960,7 @@ class TeamBalancer:
         """Delete a pending game without recording a result"""
         if game_id not in self.pending_games:
             return f"❌ Partita {game_id} non trovata"
-        del self.pending_games[game_id]
+        self._remove_pending_game(game_id)
         return f"✅ Partita {game_id} eliminata"
 
     def delete_game_from_history(self, game_id: str) -> str:
@@ -693,8 +977,8 @@ class TeamBalancer:
                 'played_at', desc=False
             ).execute()
             all_games = all_history.data if all_history.data else []
-        except Exception as e:
-            print(f"Errore lettura storico: {e}")
+        except Exception:
+            log.exception("Errore lettura storico")
             return "❌ Errore nel recupero dello storico"
 
         target = next((g for g in all_games if g['game_id'] == game_id), None)
@@ -735,12 +1019,13 @@ class TeamBalancer:
                 if g['game_id'] == game_id:
                     continue
                 self._replay_game(g)
+        self._mark_changed()
 
         # Delete from Supabase
         try:
             self.supabase.table('game_history').delete().eq('game_id', game_id).execute()
-        except Exception as e:
-            print(f"Errore eliminazione partita da Supabase: {e}")
+        except Exception:
+            log.exception("Errore eliminazione partita %s da Supabase", game_id)
             return "❌ Errore nell'eliminazione della partita"
 
         return f"✅ Partita {game_id} eliminata e rating aggiornati"
@@ -758,43 +1043,7 @@ class TeamBalancer:
         if not team1_players or not team2_players:
             return
 
-        if team1_score > team2_score:
-            team1_result, team2_result = 1.0, 0.0
-        elif team2_score > team1_score:
-            team1_result, team2_result = 0.0, 1.0
-        else:
-            team1_result, team2_result = 0.5, 0.5
-
-        team1_avg_elo = sum(p.elo for p in team1_players) / len(team1_players)
-        team2_avg_elo = sum(p.elo for p in team2_players) / len(team2_players)
-
-        expected1 = 1 / (1 + 10 ** ((team2_avg_elo - team1_avg_elo) / 400))
-        expected2 = 1 / (1 + 10 ** ((team1_avg_elo - team2_avg_elo) / 400))
-
-        goal_diff = abs(team1_score - team2_score)
-        goal_multiplier = 1 + (goal_diff - 1) * 0.1
-
-        for player in team1_players:
-            k = self._get_player_k_factor(player)
-            perf_weight = self._get_performance_weight(player.elo, team1_avg_elo, team1_result == 1.0)
-            change = k * goal_multiplier * perf_weight * (team1_result - expected1)
-            player.elo = int(player.elo + change)
-            player.games_played += 1
-            if team1_result == 1.0:
-                player.wins += 1
-            elif team1_result == 0.0:
-                player.losses += 1
-
-        for player in team2_players:
-            k = self._get_player_k_factor(player)
-            perf_weight = self._get_performance_weight(player.elo, team2_avg_elo, team2_result == 1.0)
-            change = k * goal_multiplier * perf_weight * (team2_result - expected2)
-            player.elo = int(player.elo + change)
-            player.games_played += 1
-            if team2_result == 1.0:
-                player.wins += 1
-            elif team2_result == 0.0:
-                player.losses += 1
+        self._apply_game_result(team1_players, team2_players, team1_score, team2_score)
 
     def get_game_history(self, limit: int = 10) -> str:
         """Ottieni storico ultime partite"""
@@ -809,17 +1058,17 @@ class TeamBalancer:
             if not result.data:
                 return "📜 Nessuna partita nello storico"
 
-            message = f"📜 *ULTIME {len(result.data)} PARTITE*\n\n"
+            parts = [f"📜 *ULTIME {len(result.data)} PARTITE*\n\n"]
             for game in result.data:
                 date = game.get('played_at', '')[:10] if game.get('played_at') else 'N/A'
-                message += f"📅 {date}\n"
-                message += f"🔵 {', '.join(game['team1'][:3])}... vs 🔴 {', '.join(game['team2'][:3])}...\n"
-                message += f"⚽ {game['team1_score']} - {game['team2_score']} | 🏆 {game['winner']}\n\n"
+                parts.append(f"📅 {date}\n")
+                parts.append(f"🔵 {', '.join(game['team1'][:3])}... vs 🔴 {', '.join(game['team2'][:3])}...\n")
+                parts.append(f"⚽ {game['team1_score']} - {game['team2_score']} | 🏆 {game['winner']}\n\n")
 
-            return message
+            return ''.join(parts)
 
-        except Exception as e:
-            print(f"Errore lettura storico: {e}")
+        except Exception:
+            log.exception("Errore lettura storico")
             return "❌ Errore nel recupero storico partite"
 
     def record_manual_game(self, team1_names: List[str], team2_names: List[str],
@@ -834,6 +1083,9 @@ class TeamBalancer:
             team1_score: Gol segnati dal Team 1
             team2_score: Gol segnati dal Team 2
         """
+        if not _valid_score(team1_score, team2_score):
+            return f"❌ I punteggi devono essere tra 0 e {MAX_SCORE}"
+
         # Verifica che ci siano 5 giocatori per squadra
         if len(team1_names) != 5 or len(team2_names) != 5:
             return f"❌ Ogni squadra deve avere 5 giocatori. Team 1: {len(team1_names)}, Team 2: {len(team2_names)}"
@@ -862,83 +1114,22 @@ class TeamBalancer:
 
         # Determina esito partita
         if team1_score > team2_score:
-            team1_result = 1.0
-            team2_result = 0.0
             winner = "Team 1"
         elif team2_score > team1_score:
-            team1_result = 0.0
-            team2_result = 1.0
             winner = "Team 2"
         else:
-            team1_result = 0.5
-            team2_result = 0.5
             winner = "Pareggio"
 
-        # Calcola ELO medio
-        team1_avg_elo = sum(p.elo for p in team1_players) / len(team1_players)
-        team2_avg_elo = sum(p.elo for p in team2_players) / len(team2_players)
-
-        # Expected scores usando formula ELO
-        expected1 = 1 / (1 + 10 ** ((team2_avg_elo - team1_avg_elo) / 400))
-        expected2 = 1 / (1 + 10 ** ((team1_avg_elo - team2_avg_elo) / 400))
-
-        # Moltiplicatore differenza gol
-        goal_diff = abs(team1_score - team2_score)
-        goal_multiplier = 1 + (goal_diff - 1) * 0.1
-
         # Aggiorna rating con K-factor individuale e peso performance
         rating_changes = []
         elo_changes = {}
+        team1_avg_elo, team2_avg_elo = self._apply_game_result(
+            team1_players, team2_players, team1_score, team2_score,
+            rating_changes, elo_changes
+        )
 
-        for player in team1_players:
-            old_elo = player.elo
-            old_games = player.games_played
-            old_wins = player.wins
-            old_losses = player.losses
-            # K-factor individuale
-            k = self._get_player_k_factor(player)
-            # Peso performance
-            perf_weight = self._get_performance_weight(player.elo, team1_avg_elo, team1_result == 1.0)
-            # Calcolo cambio rating
-            base_change = (team1_result - expected1)
-            change = k * goal_multiplier * perf_weight * base_change
-            player.elo = int(player.elo + change)
-            player.games_played += 1
-            if team1_result == 1.0:
-                player.wins += 1
-            elif team1_result == 0.0:
-                player.losses += 1
-            rating_changes.append(f"  {player.name}: {old_elo} → {player.elo} ({change:+.0f})")
-            elo_changes[player.name] = {
-                'elo_before': old_elo, 'elo_after': player.elo,
-                'games_before': old_games, 'wins_before': old_wins, 'losses_before': old_losses,
-                'won': team1_result == 1.0, 'drew': team1_result == 0.5
-            }
-
-        for player in team2_players:
-            old_elo = player.elo
-            old_games = player.games_played
-            old_wins = player.wins
-            old_losses = player.losses
-            # K-factor individuale
-            k = self._get_player_k_factor(player)
-            # Peso performance
-            perf_weight = self._get_performance_weight(player.elo, team2_avg_elo, team2_result == 1.0)
-            # Calcolo cambio rating
-            base_change = (team2_result - expected2)
-            change = k * goal_multiplier * perf_weight * base_change
-            player.elo = int(player.elo + change)
-            player.games_played += 1
-            if team2_result == 1.0:
-                player.wins += 1
-            elif team2_result == 0.0:
-                player.losses += 1
-            rating_changes.append(f"  {player.name}: {old_elo} → {player.elo} ({change:+.0f})")
-            elo_changes[player.name] = {
-                'elo_before': old_elo, 'elo_after': player.elo,
-                'games_before': old_games, 'wins_before': old_wins, 'losses_before': old_losses,
-                'won': team2_result == 1.0, 'drew': team2_result == 0.5
-            }
+        team1_avg_int = int(team1_avg_elo)
+        team2_avg_int = int(team2_avg_elo)
 
         # Genera game_id
         game_id = datetime.now().strftime("%Y%m%d_%H%M%S") + "_manual"
@@ -950,25 +1141,23 @@ class TeamBalancer:
             team2=[p.name for p in team2_players],
             team1_score=team1_score,
             team2_score=team2_score,
-            team1_avg_elo=int(team1_avg_elo),
-            team2_avg_elo=int(team2_avg_elo),
+            team1_avg_elo=team1_avg_int,
+            team2_avg_elo=team2_avg_int,
             winner=winner,
             elo_changes=elo_changes
         )
 
         # Formato messaggio risposta
-        message = f"📊 *PARTITA REGISTRATA*\n\n"
-        message += f"🔵 *Team 1* ({int(team1_avg_elo)} ELO): {team1_score}\n"
-        for p in team1_players:
-            message += f"  • {p.name}\n"
-        message += f"\n🔴 *Team 2* ({int(team2_avg_elo)} ELO): {team2_score}\n"
-        for p in team2_players:
-            message += f"  • {p.name}\n"
-        message += f"\n🏆 Vincitore: {winner}\n\n"
-        message += f"*Cambi di Rating:*\n"
-        message += "\n".join(rating_changes)
-
-        return message
+        parts = ["📊 *PARTITA REGISTRATA*\n\n",
+                 f"🔵 *Team 1* ({team1_avg_int} ELO): {team1_score}\n"]
+        parts.extend(f"  • {p.name}\n" for p in team1_players)
+        parts.append(f"\n🔴 *Team 2* ({team2_avg_int} ELO): {team2_score}\n")
+        parts.extend(f"  • {p.name}\n" for p in team2_players)
+        parts.append(f"\n🏆 Vincitore: {winner}\n\n")
+        parts.append("*Cambi di Rating:*\n")
+        parts.append("\n".join(rating_changes))
+
+        return ''.join(parts)
 
 
 # Example usage and testing
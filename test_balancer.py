@@ -3,6 +3,12 @@ Test script for Football Team Balancer
 Run this to verify the core logic before connecting to WhatsApp
 """
 
+import json
+import os
+import tempfile
+from datetime import datetime
+from types import SimpleNamespace
+
 from football_balancer import TeamBalancer
 
 def test_basic_flow():
@@ -201,10 +207,257 @@ def test_elo_calculations():
     print("- Underdog victories are rewarded more")
 
 
+def test_data_file_formats():
+    """Test loading the legacy data file and round-tripping the current format"""
+    print("\n" + "=" * 60)
+    print("DATA FILE FORMAT TEST")
+    print("=" * 60)
+    
+    pending = {
+        "20240205_143022": {
+            "game_id": "20240205_143022",
+            "team1": ["John", "Mike"],
+            "team2": ["Sarah", "Tom"],
+            "team1_avg_elo": 1700,
+            "team2_avg_elo": 1650,
+            "timestamp": "2024-02-05T14:30:22",
+            "display_ts": "2024-02-05 14:30"
+        }
+    }
+    # Format written before players were stored as rows: {name: {fields}}
+    legacy = {
+        "players": {
+            "John": {"name": "John", "elo": 1666, "games_played": 3, "wins": 2, "losses": 1},
+            "Mike": {"name": "Mike", "elo": 1777, "games_played": 0, "wins": 0, "losses": 0}
+        },
+        "pending_games": pending,
+        "k_factor": 24
+    }
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_file = os.path.join(tmp, 'legacy.json')
+        with open(legacy_file, 'w') as f:
+            json.dump(legacy, f, indent=2)
+        
+        balancer = TeamBalancer()
+        assert balancer.load_from_file(legacy_file)
+        assert {name: p.to_dict() for name, p in balancer.players.items()} == legacy["players"]
+        assert balancer.pending_games == pending
+        assert balancer.base_k_factor == 24
+        assert balancer._find_player("john") is balancer.players["John"]
+        print("✅ Legacy format loaded: 2 players, 1 pending game")
+        
+        # Saving writes the current format, which must load back identically
+        new_file = os.path.join(tmp, 'new.json')
+        balancer.add_player("Sarah", 6)
+        balancer.save_to_file(new_file)
+        with open(new_file) as f:
+            saved = json.load(f)
+        assert isinstance(saved["players"], list)
+        
+        reloaded = TeamBalancer()
+        assert reloaded.load_from_file(new_file)
+        assert ({name: p.to_dict() for name, p in reloaded.players.items()} ==
+                {name: p.to_dict() for name, p in balancer.players.items()})
+        assert reloaded.pending_games == pending
+        assert reloaded.base_k_factor == 24
+        print(f"✅ Current format round-tripped: {len(reloaded.players)} players, "
+              f"{len(reloaded.pending_games)} pending game")
+
+
+def test_participant_parsing():
+    """Test participant list parsing: list prefixes, indentation and commas"""
+    print("\n" + "=" * 60)
+    print("PARTICIPANT LIST PARSING TEST")
+    print("=" * 60)
+    
+    balancer = TeamBalancer()
+    cases = [
+        # Numbered, bulleted and indented lines lose their prefix
+        ("1. John\n2) Mike\n- Sarah\n• Tom\n   3. Emma\n\t- David\n  Lisa  \n\n",
+         ["John", "Mike", "Sarah", "Tom", "Emma", "David", "Lisa"]),
+        # Hyphens and spaces inside names are kept
+        ("Anna-Maria\nJean Luc\nO'Neil", ["Anna-Maria", "Jean Luc", "O'Neil"]),
+        # Comma-separated, with stray spaces and empty entries
+        ("John, Mike ,Sarah,, Tom ", ["John", "Mike", "Sarah", "Tom"]),
+        ("1. John, Mike", ["John", "Mike"]),
+        # Nothing to parse
+        ("", []),
+        ("\n\n", []),
+    ]
+    
+    for message, expected in cases:
+        names = balancer.parse_participant_list(message)
+        assert names == expected, f"{message!r}: {names} != {expected}"
+        print(f"  {message!r} → {names}")
+    print("✅ Participant lists parsed")
+
+
+def test_score_parsing():
+    """Test score parsing: separators, game id prefix and rejected inputs"""
+    print("\n" + "=" * 60)
+    print("SCORE PARSING TEST")
+    print("=" * 60)
+    
+    balancer = TeamBalancer()
+    cases = [
+        ("5-3", (5, 3)),
+        ("3:2", (3, 2)),
+        ("3 - 2", (3, 2)),
+        ("5 3", (5, 3)),
+        ("score 10:0 ok", (10, 0)),
+        # The game id digits are not mistaken for a score
+        ("20240205_143022 5-3", (5, 3)),
+        # Rejected
+        ("hello", None),
+        ("", None),
+        ("-", None),
+        ("5", None),
+        ("5-", None),
+        ("abc-def", None),
+        # Out of range (0-99 goals per team)
+        ("99-0", (99, 0)),
+        ("100-3", None),
+    ]
+    
+    for message, expected in cases:
+        score = balancer.parse_score(message)
+        assert score == expected, f"{message!r}: {score} != {expected}"
+        print(f"  {message!r} → {score}")
+    print("✅ Scores parsed")
+
+
+class FakeHistoryClient:
+    """In-memory stand-in for the Supabase client (game_history only)"""
+    
+    def __init__(self):
+        self.rows = []
+        self._delete_filter = None
+    
+    def table(self, name):
+        self._delete_filter = None
+        return self
+    
+    def insert(self, record):
+        self.rows.append(dict(record, played_at=datetime.now().isoformat()))
+        return self
+    
+    def select(self, *args):
+        return self
+    
+    def order(self, *args, **kwargs):
+        return self
+    
+    def delete(self):
+        self._delete_filter = ()
+        return self
+    
+    def eq(self, column, value):
+        self._delete_filter = (column, value)
+        return self
+    
+    def execute(self):
+        if self._delete_filter:
+            column, value = self._delete_filter
+            self.rows = [row for row in self.rows if row[column] != value]
+        return SimpleNamespace(data=list(self.rows))
+
+
+def test_leaderboard_cache():
+    """Test that cached rankings follow every state change"""
+    print("\n" + "=" * 60)
+    print("LEADERBOARD CACHE TEST")
+    print("=" * 60)
+    
+    balancer = TeamBalancer()
+    balancer.supabase = FakeHistoryClient()
+    participants = [f"Player{i}" for i in range(1, 11)]
+    for i, name in enumerate(participants, 1):
+        balancer.add_player(name, i)
+    
+    def check(step):
+        # The cached text and ranking must match a fresh rebuild
+        leaderboard = balancer.get_leaderboard()
+        assert leaderboard == balancer._build_leaderboard(10), step
+        ranked = sorted(balancer.players.values(), key=lambda p: p.elo, reverse=True)
+        assert [p.elo for p in balancer.get_top_players(5)] == [p.elo for p in ranked[:5]], step
+        assert [d['elo'] for d in balancer.get_players_data()] == [p.elo for p in ranked], step
+        print(f"✅ Leaderboard up to date after {step}")
+        return leaderboard
+    
+    check("initial load")
+    
+    balancer.add_player("Newcomer", 10)
+    before_game = check("add_player")
+    assert "Newcomer" in before_game
+    
+    teams, _ = balancer.create_teams(participants)
+    balancer.update_ratings(teams['game_id'], 5, 0)
+    after_game = check("update_ratings")
+    assert after_game != before_game
+    
+    result = balancer.delete_game_from_history(teams['game_id'])
+    assert result.startswith("✅"), result
+    assert check("delete_game_from_history") == before_game
+    
+    result = balancer.record_manual_game(participants[:5], participants[5:], 0, 3)
+    assert result.startswith("📊"), result
+    assert check("record_manual_game") != before_game
+
+
+def test_save_only_when_changed():
+    """Test that saving writes the data file only after a change"""
+    print("\n" + "=" * 60)
+    print("SAVE ON CHANGE TEST")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, 'data.json')
+        
+        balancer = TeamBalancer()
+        balancer.save_to_file(data_file)
+        assert not os.path.exists(data_file), "new balancer saved without changes"
+        
+        balancer.add_player("John", 7)
+        balancer.save_to_file(data_file)
+        assert os.path.exists(data_file), "add_player was not saved"
+        print("✅ Saved after add_player")
+        
+        os.remove(data_file)
+        balancer.save_to_file(data_file)
+        assert not os.path.exists(data_file), "saved again without changes"
+        print("✅ No write when nothing changed")
+        
+        balancer.add_player("Mike", 8)
+        balancer.save_to_file(data_file)
+        
+        # Loading replaces the state but is not a change to save
+        reloaded = TeamBalancer()
+        assert reloaded.load_from_file(data_file)
+        os.remove(data_file)
+        reloaded.save_to_file(data_file)
+        assert not os.path.exists(data_file), "saved right after loading"
+        print("✅ No write right after loading")
+        
+        reloaded.update_ratings("missing_game", 1, 0)
+        reloaded.save_to_file(data_file)
+        assert not os.path.exists(data_file), "failed update was saved"
+        
+        reloaded.add_player("Sarah", 6)
+        reloaded.save_to_file(data_file)
+        assert os.path.exists(data_file), "change after loading was not saved"
+        print("✅ Saved after a change to loaded data")
+
+
 if __name__ == "__main__":
     try:
         test_basic_flow()
         test_elo_calculations()
+        test_data_file_formats()
+        test_participant_parsing()
+        test_score_parsing()
+        test_leaderboard_cache()
+        test_save_only_when_changed()
         print("\n✅ All tests passed successfully!")
     except Exception as e:
         print(f"\n❌ Test failed with error: {e}")
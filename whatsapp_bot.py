@@ -5,18 +5,28 @@ Uses Twilio WhatsApp API and Flask
 Setup instructions:
 1. pip install flask twilio apscheduler
 2. Set environment variables: TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER
-3. Run: python whatsapp_bot.py
+3. Run: gunicorn -w 1 -k gthread --threads 8 whatsapp_bot:app
+   (or python whatsapp_bot.py for local testing; set FLASK_DEBUG=1 for the debugger)
 4. Expose via ngrok or deploy to cloud
 """
 
+import atexit
+import logging
 import os
+import re
+import threading
 from datetime import datetime, timedelta
 from flask import Flask, request
+from requests.adapters import HTTPAdapter
+from twilio.http.http_client import TwilioHttpClient
 from twilio.rest import Client
 from twilio.twiml.messaging_response import MessagingResponse
 from apscheduler.schedulers.background import BackgroundScheduler
+from urllib3.util.retry import Retry
 from football_balancer import TeamBalancer
 
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
 app = Flask(__name__)
 
 # Initialize Twilio
@@ -24,20 +34,60 @@ TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN')
 TWILIO_WHATSAPP_NUMBER = os.environ.get('TWILIO_WHATSAPP_NUMBER', 'whatsapp:+14155238886')
 
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+# One pooled keep-alive session shared by webhook replies and reminder jobs.
+# Retries only cover connection failures (POST is not retried by urllib3),
+# so a message is never sent twice.
+twilio_http_client = TwilioHttpClient(pool_connections=True, timeout=10)
+twilio_http_client.session.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.2)
+))
+twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=twilio_http_client)
 
 # Initialize Team Balancer
 balancer = TeamBalancer()
 balancer.load_from_file()
 
+# Game ids as generated by TeamBalancer.confirm_teams (e.g. 20240205_143022)
+GAME_ID_RE = re.compile(r'\d{8}_\d{6}')
+
+# Serializes access to the balancer between request threads and the save job
+balancer_lock = threading.Lock()
+
+# Changes are flushed to disk in the background instead of on every message
+SAVE_INTERVAL_SECONDS = 5
+
+REMINDER_TEXT = (
+    "⚽ *GAME RESULT REQUEST*\n\n"
+    "How did yesterday's game go?\n\n"
+    "Reply with the score (e.g., '5-3' or '3-2')\n"
+    "_Game ID: {game_id}_"
+)
+
 # Store game timestamps for next-day reminders
 game_reminders = {}  # game_id -> (phone_number, timestamp)
 
-# Scheduler for sending reminders
-scheduler = BackgroundScheduler()
+# Scheduler for reminders and the periodic save. Missed runs of a job are
+# merged into one and never overlap, so slow saves cannot pile up.
+scheduler = BackgroundScheduler(job_defaults={
+    'coalesce': True,
+    'max_instances': 1,
+    'misfire_grace_time': 60,
+})
 scheduler.start()
 
 
+def flush_balancer(force: bool = False):
+    """Persist balancer state if anything changed since the last save"""
+    with balancer_lock:
+        balancer.save_to_file(force=force)
+
+
+scheduler.add_job(flush_balancer, 'interval', seconds=SAVE_INTERVAL_SECONDS, id='flush_balancer')
+atexit.register(flush_balancer, force=True)
+
+
 def send_whatsapp_message(to_number: str, message: str):
     """Send WhatsApp message via Twilio"""
     try:
@@ -57,45 +107,20 @@ def schedule_score_request(game_id: str, phone_number: str):
     send_time = datetime.now() + timedelta(hours=24)
     
     def send_reminder():
-        message = f"⚽ *GAME RESULT REQUEST*\n\n"
-        message += f"How did yesterday's game go?\n\n"
-        message += f"Reply with the score (e.g., '5-3' or '3-2')\n"
-        message += f"_Game ID: {game_id}_"
-        send_whatsapp_message(phone_number, message)
+        send_whatsapp_message(phone_number, REMINDER_TEXT.format(game_id=game_id))
     
     scheduler.add_job(
         send_reminder,
         'date',
         run_date=send_time,
-        id=f'reminder_{game_id}'
+        id=f'reminder_{game_id}',
+        misfire_grace_time=None  # a late reminder is still sent
     )
     
     game_reminders[game_id] = (phone_number, send_time)
 
 
-def handle_message(incoming_message: str, from_number: str) -> str:
-    """Process incoming WhatsApp message and return response"""
-    
-    message = incoming_message.strip().lower()
-    
-    # Command: Add player
-    if message.startswith('add '):
-        # Format: "add John 7"
-        parts = incoming_message.split()
-        if len(parts) >= 3:
-            name = ' '.join(parts[1:-1])
-            try:
-                vote = int(parts[-1])
-                response = balancer.add_player(name, vote)
-                balancer.save_to_file()
-                return response
-            except ValueError:
-                return "❌ Invalid format. Use: add [name] [rating 1-10]"
-        return "❌ Invalid format. Use: add [name] [rating 1-10]"
-    
-    # Command: Help
-    elif message in ['help', 'commands', 'start']:
-        return """⚽ *FOOTBALL TEAM BALANCER*
+HELP_TEXT = """⚽ *FOOTBALL TEAM BALANCER*
 
 *Commands:*
 • *add [name] [rating]* - Add player (e.g., "add John 7")
@@ -110,18 +135,8 @@ def handle_message(incoming_message: str, from_number: str) -> str:
 2️⃣ Send "teams" then list 10 participants
 3️⃣ Next day, send "score" then the result
 """
-    
-    # Command: Leaderboard
-    elif message in ['leaderboard', 'rankings', 'top']:
-        return balancer.get_leaderboard()
-    
-    # Command: Pending games
-    elif message in ['pending', 'games']:
-        return balancer.get_pending_games()
-    
-    # Command: Teams (start team selection)
-    elif message == 'teams':
-        return """⚽ *TEAM SELECTION MODE*
+
+TEAMS_PROMPT = """⚽ *TEAM SELECTION MODE*
 
 Send me the list of 10 participants, one per line or comma-separated.
 
@@ -134,21 +149,77 @@ Tom
 
 Or: John, Mike, Sarah, Tom, ...
 """
+
+
+def score_prompt() -> str:
+    """Command: Score (start score submission)"""
+    pending = balancer.get_pending_games()
+    if pending == "No pending games":
+        return "❌ No pending games. Create teams first!"
+    return f"{pending}\n\nReply with: [game_id] [score]\nExample: 20240205_143022 5-3"
+
+
+def add_player_command(message: str) -> str:
+    """Command: add [name] [rating]"""
+    # Format: "add John 7"
+    parts = message.split()
+    if len(parts) >= 3:
+        name = ' '.join(parts[1:-1])
+        try:
+            vote = int(parts[-1])
+            return balancer.add_player(name, vote)
+        except ValueError:
+            return "❌ Invalid format. Use: add [name] [rating 1-10]"
+    return "❌ Invalid format. Use: add [name] [rating 1-10]"
+
+
+# Commands with arguments: first word -> handler taking the stripped message
+PREFIX_COMMANDS = {
+    'add': add_player_command,
+}
+
+# Exact (casefolded) command -> handler returning the response text
+COMMAND_HANDLERS = {
+    'help': lambda: HELP_TEXT,
+    'commands': lambda: HELP_TEXT,
+    'start': lambda: HELP_TEXT,
+    'leaderboard': balancer.get_leaderboard,
+    'rankings': balancer.get_leaderboard,
+    'top': balancer.get_leaderboard,
+    'pending': balancer.get_pending_games,
+    'games': balancer.get_pending_games,
+    'teams': lambda: TEAMS_PROMPT,
+    'score': score_prompt,
+}
+
+
+def handle_message(incoming_message: str, from_number: str) -> str:
+    """Process incoming WhatsApp message and return response
+
+    Balancer changes are not saved here: the background flush job persists
+    them every SAVE_INTERVAL_SECONDS.
+    """
     
-    # Command: Score (start score submission)
-    elif message == 'score':
-        pending = balancer.get_pending_games()
-        if pending == "No pending games":
-            return "❌ No pending games. Create teams first!"
-        return f"{pending}\n\nReply with: [game_id] [score]\nExample: 20240205_143022 5-3"
+    stripped = incoming_message.strip()
+    message = stripped.casefold()
+    
+    # Exact commands (help, leaderboard, pending, teams, score, ...)
+    handler = COMMAND_HANDLERS.get(message)
+    if handler:
+        return handler()
+    
+    # Commands with arguments (add)
+    command, sep, _ = message.partition(' ')
+    handler = PREFIX_COMMANDS.get(command) if sep else None
+    if handler:
+        return handler(stripped)
     
     # Try to parse as participant list (if contains newlines or multiple names)
-    elif '\n' in incoming_message or ',' in incoming_message:
+    if '\n' in incoming_message or ',' in incoming_message:
         names = balancer.parse_participant_list(incoming_message)
         if len(names) == 10:
             teams, response = balancer.create_teams(names)
             if teams:
-                balancer.save_to_file()
                 # Schedule reminder for next day
                 schedule_score_request(teams['game_id'], from_number.replace('whatsapp:', ''))
                 response += "\n\n✅ Reminder scheduled for tomorrow to record the score!"
@@ -157,38 +228,36 @@ Or: John, Mike, Sarah, Tom, ...
             return f"❌ Expected 10 players, got {len(names)}. Please send exactly 10 names."
     
     # Try to parse as score submission
-    elif any(char in message for char in ['-', ' ']) and any(char.isdigit() for char in message):
-        # Check if message contains game_id
-        words = incoming_message.split()
+    score = balancer.parse_score(incoming_message)
+    if score:
+        pending_count = len(balancer.pending_games)
+        if not pending_count:
+            return "❌ No pending games. Create teams first!"
+        single_id = next(iter(balancer.pending_games)) if pending_count == 1 else None
         
-        # Try to find game_id and score
+        # Check if message contains game_id and a standalone score
         game_id = None
-        score_str = None
+        word_score = None
         
-        for word in words:
-            if '_' in word and len(word) > 10:  # Looks like a game_id
+        # Stop as soon as both a game id and a score were found
+        for word in stripped.split():
+            if game_id is None and GAME_ID_RE.fullmatch(word):
                 game_id = word
-            elif balancer.parse_score(word):
-                score_str = word
+                continue
+            if word_score is None:
+                word_score = balancer.parse_score(word)
+            if game_id and word_score:
+                break
         
         # If only one pending game, use that
-        if not game_id and len(balancer.pending_games) == 1:
-            game_id = list(balancer.pending_games.keys())[0]
+        game_id = game_id or single_id
         
-        if game_id and score_str:
-            score = balancer.parse_score(score_str)
-            if score:
-                response = balancer.update_ratings(game_id, score[0], score[1])
-                balancer.save_to_file()
-                return response
+        if game_id and word_score:
+            return balancer.update_ratings(game_id, word_score[0], word_score[1])
         
         # Try just score if one pending game
-        score = balancer.parse_score(incoming_message)
-        if score and len(balancer.pending_games) == 1:
-            game_id = list(balancer.pending_games.keys())[0]
-            response = balancer.update_ratings(game_id, score[0], score[1])
-            balancer.save_to_file()
-            return response
+        if single_id:
+            return balancer.update_ratings(single_id, score[0], score[1])
         
         return "❌ Could not parse score. Use format: [game_id] 5-3\nOr just '5-3' if only one pending game."
     
@@ -203,7 +272,8 @@ def webhook():
     from_number = request.values.get('From', '')
     
     # Process message
-    response_text = handle_message(incoming_msg, from_number)
+    with balancer_lock:
+        response_text = handle_message(incoming_msg, from_number)
     
     # Create Twilio response
     resp = MessagingResponse()
@@ -223,6 +293,9 @@ if __name__ == '__main__':
     print(f"Players loaded: {len(balancer.players)}")
     print(f"Pending games: {len(balancer.pending_games)}")
     
-    # Run Flask app
+    # Run Flask app. The debugger and reloader are opt-in via FLASK_DEBUG;
+    # production should use gunicorn with a single worker (state and
+    # scheduler live in this process) and a thread pool.
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    debug = os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes')
+    app.run(host='0.0.0.0', port=port, debug=debug, threaded=True)
@@ -4,24 +4,69 @@ Usa Meta Cloud API (GRATUITO)
 
 Istruzioni di configurazione in SETUP_GUIDE.md
 
+Avvio in produzione (un solo worker: giocatori, sessioni e promemoria
+sono in memoria; i thread gestiscono le richieste concorrenti):
+    gunicorn -w 1 -k gthread --threads 16 -b 0.0.0.0:$PORT whatsapp_bot_meta:app
+`python whatsapp_bot_meta.py` avvia il server di sviluppo di Flask, solo per prove locali.
+
 Variabili d'ambiente necessarie:
 - META_ACCESS_TOKEN: Il tuo token WhatsApp Business API
 - META_PHONE_NUMBER_ID: Il tuo ID numero di telefono WhatsApp
 - WEBHOOK_VERIFY_TOKEN: Stringa casuale per verifica webhook
 """
 
+import atexit
+import heapq
+import hmac
+import json
+import logging
 import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 load_dotenv()
 
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 from flask import Flask, request, jsonify, make_response, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from apscheduler.schedulers.background import BackgroundScheduler
-from football_balancer import TeamBalancer
+from football_balancer import MAX_SCORE, TeamBalancer
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Serializzazione JSON di Flask (jsonify, get_json) tramite orjson"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # orjson rifiuta gli interi oltre i 64 bit: si usa il json di Flask
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+if ORJSON_AVAILABLE:
+    app.json = OrjsonProvider(app)
+
 # Meta Cloud API Configuration
 META_ACCESS_TOKEN = os.environ.get('META_ACCESS_TOKEN')
 META_PHONE_NUMBER_ID = os.environ.get('META_PHONE_NUMBER_ID')
@@ -29,21 +74,89 @@ WEBHOOK_VERIFY_TOKEN = os.environ.get('WEBHOOK_VERIFY_TOKEN', 'my_secret_token')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', '')
 META_API_VERSION = 'v18.0'
 META_API_URL = f'https://graph.facebook.com/{META_API_VERSION}/{META_PHONE_NUMBER_ID}/messages'
+META_API_TIMEOUT = 10  # secondi
+
+# ID partita generato da TeamBalancer.confirm_teams (es. 20240205_143022)
+GAME_ID_RE = re.compile(r'\d{8}_\d{6}')
+
+# "aggiungi [nome] [voto]": nome di una o più parole, voto intero finale
+ADD_PLAYER_RE = re.compile(r'\S+\s+(.+?)\s+([+-]?\d+)')
+
+# Sessione HTTP condivisa: riusa le connessioni TCP/TLS verso la Graph API
+# invece di aprirne una nuova per ogni messaggio
+meta_session = requests.Session()
+meta_session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=50))
+meta_session.headers.update({
+    'Authorization': f'Bearer {META_ACCESS_TOKEN}',
+    'Content-Type': 'application/json'
+})
 
 # Initialize Team Balancer
 balancer = TeamBalancer()
 balancer.load_from_file()
 
 # Memorizza timestamp partite per promemoria del giorno dopo
-game_reminders = {}
+game_reminders = {}  # game_id -> (phone_number, send_time)
 
 # Memorizza stato conversazione per registrazione manuale partite
-manual_game_sessions = {}  # phone_number -> {'step': ..., 'team1': [], 'team2': [], ...}
-
-# Scheduler per invio promemoria
-scheduler = BackgroundScheduler()
+manual_game_sessions = {}  # phone_number -> {'step': ..., 'team1': [], 'team2': [], 'ts': ...}
+
+# Sessioni di registrazione manuale abbandonate da più di così vengono scartate
+MANUAL_SESSION_TTL_SECONDS = 30 * 60
+
+# Scheduler per i job periodici (salvataggio, pulizia sessioni). I promemoria
+# hanno un proprio heap persistito su file (vedi schedule_score_request).
+# Le esecuzioni perse si accorpano in una sola invece di accodarsi.
+scheduler = BackgroundScheduler(job_defaults={
+    'coalesce': True,
+    'max_instances': 1,
+    'misfire_grace_time': 60,
+})
 scheduler.start()
 
+# Chiamate alla Graph API fuori dal thread del webhook (conferme di lettura),
+# così Meta riceve subito il 200 senza attendere
+executor = ThreadPoolExecutor(max_workers=8)
+
+# Messaggi in arrivo, elaborati da un solo thread nell'ordine di ricezione:
+# i messaggi di uno stesso mittente (es. "partita manuale" e poi le squadre)
+# non si scavalcano, e handle_message lavora comunque sotto balancer_lock
+incoming_queue = queue.Queue()
+
+# Serializza le modifiche al balancer (messaggi, API della dashboard, salvataggio)
+balancer_lock = threading.Lock()
+
+# Le modifiche (messaggi e API della dashboard) vengono salvate in background,
+# non a ogni richiesta
+SAVE_INTERVAL_SECONDS = 5
+
+
+def flush_balancer(force: bool = False):
+    """Salva lo stato del balancer se è cambiato dall'ultimo salvataggio"""
+    with balancer_lock:
+        balancer.save_to_file(force=force)
+
+
+def expire_manual_sessions():
+    """Rimuove le sessioni di registrazione manuale inattive da troppo tempo"""
+    cutoff = time.monotonic() - MANUAL_SESSION_TTL_SECONDS
+    with balancer_lock:
+        for phone_number, session in list(manual_game_sessions.items()):
+            if session['ts'] < cutoff:
+                del manual_game_sessions[phone_number]
+
+
+scheduler.add_job(flush_balancer, 'interval', seconds=SAVE_INTERVAL_SECONDS, id='flush_balancer')
+scheduler.add_job(expire_manual_sessions, 'interval', minutes=5, id='expire_manual_sessions')
+atexit.register(flush_balancer, force=True)
+
+
+def _post_to_meta(payload: dict) -> requests.Response:
+    """POST alla Graph API; con orjson il payload viene codificato senza passare da json"""
+    if ORJSON_AVAILABLE:
+        return meta_session.post(META_API_URL, data=orjson.dumps(payload), timeout=META_API_TIMEOUT)
+    return meta_session.post(META_API_URL, json=payload, timeout=META_API_TIMEOUT)
+
 
 def send_whatsapp_message(to_number: str, message: str):
     """Invia messaggio WhatsApp tramite Meta Cloud API"""
@@ -51,11 +164,6 @@ def send_whatsapp_message(to_number: str, message: str):
     # Rimuovi prefisso 'whatsapp:' se presente
     to_number = to_number.replace('whatsapp:', '')
     
-    headers = {
-        'Authorization': f'Bearer {META_ACCESS_TOKEN}',
-        'Content-Type': 'application/json'
-    }
-    
     payload = {
         'messaging_product': 'whatsapp',
         'recipient_type': 'individual',
@@ -68,23 +176,18 @@ def send_whatsapp_message(to_number: str, message: str):
     }
     
     try:
-        response = requests.post(META_API_URL, headers=headers, json=payload)
+        response = _post_to_meta(payload)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
-        print(f"Errore invio messaggio: {e}")
+        log.error("Errore invio messaggio: %s", e)
         if hasattr(e.response, 'text'):
-            print(f"Response: {e.response.text}")
+            log.error("Response: %s", e.response.text)
         return None
 
 
 def mark_message_as_read(message_id: str):
     """Segna un messaggio come letto"""
-    headers = {
-        'Authorization': f'Bearer {META_ACCESS_TOKEN}',
-        'Content-Type': 'application/json'
-    }
-    
     payload = {
         'messaging_product': 'whatsapp',
         'status': 'read',
@@ -92,64 +195,197 @@ def mark_message_as_read(message_id: str):
     }
     
     try:
-        response = requests.post(META_API_URL, headers=headers, json=payload)
+        response = _post_to_meta(payload)
         response.raise_for_status()
     except Exception as e:
-        print(f"Errore nel segnare come letto: {e}")
+        log.warning("Errore nel segnare come letto: %s", e)
+
+
+# Gli invii passano da una coda: un thread raccoglie i messaggi arrivati
+# nella stessa finestra e li invia in parallelo sulla sessione condivisa
+# (in ordine per ciascun destinatario), rispettando il limite di messaggi
+# al secondo della Cloud API anche con molti promemoria
+SEND_RATE_PER_SECOND = 50
+SEND_BATCH_MAX = 20
+SEND_BATCH_WINDOW_SECONDS = 0.02
+send_queue = queue.Queue()  # (numero, testo)
+send_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='whatsapp-send')
+
+
+def queue_whatsapp_message(to_number: str, message: str):
+    """Accoda un messaggio WhatsApp da inviare in background"""
+    send_queue.put((to_number, message))
+
+
+def _next_send_batch() -> list:
+    """Attende un messaggio e raccoglie quelli che arrivano subito dopo"""
+    batch = [send_queue.get()]
+    deadline = time.monotonic() + SEND_BATCH_WINDOW_SECONDS
+    while len(batch) < SEND_BATCH_MAX:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(send_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _send_in_order(messages: list):
+    """Invia in sequenza i messaggi di un destinatario"""
+    for to_number, message in messages:
+        try:
+            send_whatsapp_message(to_number, message)
+        except Exception:
+            log.exception("Errore invio messaggio in coda")
+
+
+def _send_worker():
+    """Invia i messaggi in coda a lotti, al massimo SEND_RATE_PER_SECOND al secondo"""
+    interval = 1.0 / SEND_RATE_PER_SECOND
+    next_send = time.monotonic()
+    while True:
+        batch = _next_send_batch()
+        delay = next_send - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        next_send = max(next_send, time.monotonic()) + interval * len(batch)
+
+        by_recipient = {}
+        for item in batch:
+            by_recipient.setdefault(item[0], []).append(item)
+        # Il lotto successivo parte solo a invii conclusi: l'ordine per
+        # destinatario resta quello di accodamento
+        wait([send_pool.submit(_send_in_order, messages) for messages in by_recipient.values()])
+        for _ in batch:
+            send_queue.task_done()
+
+
+threading.Thread(target=_send_worker, name='whatsapp-sender', daemon=True).start()
+
+
+# Promemoria: min-heap (scadenza, game_id, numero) servito da un solo thread
+# e salvato su file, così un riavvio non li perde. Su piattaforme con disco
+# effimero (Heroku, Railway senza volume) REMINDERS_FILE deve puntare a un
+# percorso persistente, altrimenti i promemoria si perdono a ogni deploy
+REMINDER_DELAY = timedelta(hours=24)
+REMINDERS_FILE = os.environ.get('REMINDERS_FILE', 'reminders.json')
+REMINDER_TEXT = (
+    "⚽ *RICHIESTA RISULTATO PARTITA*\n\n"
+    "Com'è andata la partita di ieri?\n\n"
+    "Rispondi con il risultato (es. '5-3' o '3-2')\n"
+    "_ID Partita: {game_id}_"
+)
+reminder_heap = []
+reminder_cv = threading.Condition()
+
+
+def _save_reminders():
+    """Salva i promemoria programmati (da chiamare con reminder_cv acquisito)"""
+    data = {game_id: [phone_number, send_time.isoformat()]
+            for game_id, (phone_number, send_time) in game_reminders.items()}
+    tmp_path = REMINDERS_FILE + '.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, REMINDERS_FILE)
+    except OSError:
+        log.exception("Errore salvataggio promemoria")
+
+
+def _load_reminders():
+    """Ricarica i promemoria salvati (quelli scaduti partono subito)"""
+    try:
+        with open(REMINDERS_FILE) as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"atteso un oggetto JSON, trovato {type(data).__name__}")
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError):
+        log.exception("Errore caricamento promemoria")
+        return
+    for game_id, entry in data.items():
+        # Le voci non valide vengono saltate: non devono impedire l'avvio dell'app
+        try:
+            phone_number, send_time = entry
+            if not isinstance(phone_number, str):
+                raise TypeError("numero non valido")
+            send_time = datetime.fromisoformat(send_time)
+        except (TypeError, ValueError):
+            log.warning("Promemoria %s non valido, ignorato: %r", game_id, entry)
+            continue
+        game_reminders[game_id] = (phone_number, send_time)
+        heapq.heappush(reminder_heap, (send_time.timestamp(), game_id, phone_number))
+
+
+def send_reminder(game_id: str, phone_number: str):
+    """Chiede il risultato della partita"""
+    queue_whatsapp_message(phone_number, REMINDER_TEXT.format(game_id=game_id))
+
+
+def _reminder_worker():
+    """Attende la scadenza dei promemoria e invia in blocco tutti quelli scaduti"""
+    while True:
+        with reminder_cv:
+            while True:
+                now = time.time()
+                if reminder_heap and reminder_heap[0][0] <= now:
+                    break
+                reminder_cv.wait(reminder_heap[0][0] - now if reminder_heap else None)
+            due = []
+            while reminder_heap and reminder_heap[0][0] <= now:
+                run_ts, game_id, phone_number = heapq.heappop(reminder_heap)
+                current = game_reminders.get(game_id)
+                if current is None or current[1].timestamp() != run_ts:
+                    continue  # Sostituito da un promemoria più recente
+                del game_reminders[game_id]
+                due.append((game_id, phone_number))
+            if due:
+                _save_reminders()
+        # Finiscono tutti insieme nella coda di invio, che li spedisce a lotti
+        for game_id, phone_number in due:
+            send_reminder(game_id, phone_number)
 
 
 def schedule_score_request(game_id: str, phone_number: str):
     """Programma un messaggio per chiedere il risultato dopo 24 ore"""
-    send_time = datetime.now() + timedelta(hours=24)
-
-    def send_reminder():
-        message = f"⚽ *RICHIESTA RISULTATO PARTITA*\n\n"
-        message += f"Com'è andata la partita di ieri?\n\n"
-        message += f"Rispondi con il risultato (es. '5-3' o '3-2')\n"
-        message += f"_ID Partita: {game_id}_"
-        send_whatsapp_message(phone_number, message)
-    
-    scheduler.add_job(
-        send_reminder,
-        'date',
-        run_date=send_time,
-        id=f'reminder_{game_id}'
-    )
-    
-    game_reminders[game_id] = (phone_number, send_time)
+    send_time = datetime.now() + REMINDER_DELAY
+    with reminder_cv:
+        game_reminders[game_id] = (phone_number, send_time)
+        heapq.heappush(reminder_heap, (send_time.timestamp(), game_id, phone_number))
+        _save_reminders()
+        reminder_cv.notify()
 
 
-def handle_message(incoming_message: str, from_number: str) -> str:
-    """Elabora messaggio WhatsApp in arrivo e restituisce risposta"""
-
-    message = incoming_message.strip().lower()
-
-    # Comando: Aggiungi giocatore
-    if message.startswith('aggiungi '):
-        parts = incoming_message.split()
-        if len(parts) >= 3:
-            name = ' '.join(parts[1:-1])
-            try:
-                vote = int(parts[-1])
-                response = balancer.add_player(name, vote)
-                balancer.save_to_file()
-                return response
-            except ValueError:
-                return "❌ Formato non valido. Usa: aggiungi [nome] [voto 1-10]"
-        return "❌ Formato non valido. Usa: aggiungi [nome] [voto 1-10]"
+_load_reminders()
+threading.Thread(target=_reminder_worker, name='reminders', daemon=True).start()
+
 
-    # Comando: Rimuovi giocatore
-    elif message.startswith('rimuovi '):
-        player_name = incoming_message[8:].strip()
-        if not player_name:
-            return "❌ Formato non valido. Usa: rimuovi [nome]"
-        response = balancer.remove_player(player_name)
-        balancer.save_to_file()
-        return response
+def process_and_reply(text_body: str, from_number: str):
+    """Elabora il messaggio e mette in coda la risposta"""
+    with balancer_lock:
+        response_text = handle_message(text_body, from_number)
+    queue_whatsapp_message(from_number, response_text)
 
-    # Comando: Aiuto
-    elif message in ['help', 'aiuto', 'comandi', 'start', 'ciao', 'hello']:
-        return """⚽ *PinoGPT*
+
+def _incoming_worker():
+    """Elabora i messaggi in arrivo uno alla volta, in ordine di ricezione"""
+    while True:
+        text_body, from_number = incoming_queue.get()
+        try:
+            process_and_reply(text_body, from_number)
+        except Exception:
+            log.exception("Errore elaborazione messaggio")
+        finally:
+            incoming_queue.task_done()
+
+
+threading.Thread(target=_incoming_worker, name='incoming-messages', daemon=True).start()
+
+
+HELP_TEXT = """⚽ *PinoGPT*
 
 *Comandi:*
 • *aggiungi [nome] [voto]* - Aggiungi giocatore
@@ -171,26 +407,60 @@ def handle_message(incoming_message: str, from_number: str) -> str:
 
 _Oppure usa "registra" per inserire partite passate!_
 """
-    
-    # Comando: Classifica
-    elif message in ['classifica', 'leaderboard', 'rankings', 'top', 'rank']:
-        return balancer.get_leaderboard()
-
-    # Comando: Partite in attesa
-    elif message in ['inattesa', 'pending', 'partite']:
-        return balancer.get_pending_games()
-
-    # Comando: Storico partite
-    elif message in ['storico', 'history', 'cronologia']:
-        return balancer.get_game_history()
-
-    # Comando: Statistiche giocatore
-    elif message.startswith('stats '):
-        player_name = incoming_message[6:].strip()
-        player = balancer._find_player(player_name)
-        if player:
-            win_rate = (player.wins / player.games_played * 100) if player.games_played > 0 else 0
-            return f"""📊 *{player.name}*
+
+MANUAL_GAME_PROMPT = """📝 *REGISTRAZIONE PARTITA MANUALE*
+
+Inserisci i 5 giocatori del *Team 1* (🔵).
+
+Formati accettati:
+• Un nome per riga
+• Separati da virgola
+
+Invia i nomi adesso! 👇"""
+
+TEAMS_PROMPT = """⚽ *MODALITÀ SELEZIONE SQUADRE*
+
+Inviami la lista di 10 partecipanti.
+
+*Opzioni formato:*
+1. Un nome per riga:
+Marco
+Luca
+Anna
+...
+
+2. Separati da virgola:
+Marco, Luca, Anna, Paolo, ...
+
+Invia la lista adesso! 👇
+"""
+
+
+def add_player_command(message: str, from_number: str) -> str:
+    """Comando: aggiungi [nome] [voto]"""
+    match = ADD_PLAYER_RE.fullmatch(message)
+    if not match:
+        return "❌ Formato non valido. Usa: aggiungi [nome] [voto 1-10]"
+    # L'intervallo 1-10 lo controlla add_player, che indica il voto ricevuto
+    name = ' '.join(match.group(1).split())
+    return balancer.add_player(name, int(match.group(2)))
+
+
+def remove_player_command(message: str, from_number: str) -> str:
+    """Comando: rimuovi [nome]"""
+    player_name = message[8:].strip()
+    if not player_name:
+        return "❌ Formato non valido. Usa: rimuovi [nome]"
+    return balancer.remove_player(player_name)
+
+
+def player_stats_command(message: str, from_number: str) -> str:
+    """Comando: stats [nome]"""
+    player_name = message[6:].strip()
+    player = balancer._find_player(player_name)
+    if player:
+        win_rate = (player.wins / player.games_played * 100) if player.games_played > 0 else 0
+        return f"""📊 *{player.name}*
 
 Punteggio ELO: {player.elo}
 Partite Giocate: {player.games_played}
@@ -198,28 +468,84 @@ Vittorie: {player.wins}
 Sconfitte: {player.losses}
 Percentuale Vittorie: {win_rate:.1f}%
 """
-        return f"❌ Giocatore '{player_name}' non trovato"
+    return f"❌ Giocatore '{player_name}' non trovato"
 
-    # Comando: Registra partita manuale
-    elif message in ['registra', 'manual', 'manuale']:
-        # Inizia sessione registrazione manuale
-        manual_game_sessions[from_number] = {'step': 'team1'}
-        return """📝 *REGISTRAZIONE PARTITA MANUALE*
 
-Inserisci i 5 giocatori del *Team 1* (🔵).
+def start_manual_game(from_number: str) -> str:
+    """Comando: registra (inizia sessione registrazione manuale)"""
+    manual_game_sessions[from_number] = {'step': 'team1', 'ts': time.monotonic()}
+    return MANUAL_GAME_PROMPT
 
-Formati accettati:
-• Un nome per riga
-• Separati da virgola
 
-Invia i nomi adesso! 👇"""
+def score_prompt(from_number: str) -> str:
+    """Comando: risultato (inserimento punteggio)"""
+    pending = balancer.get_pending_games()
+    if pending == "No pending games":
+        return "❌ Nessuna partita in attesa. Prima crea le squadre!"
+    return f"{pending}\n\n💡 Rispondi con il risultato:\n• Solo punteggio: 5-3\n• Con ID: 20240205_143022 5-3"
+
+
+def _command_table(*groups) -> dict:
+    """Espande (sinonimi, handler) in un dizionario sinonimo normalizzato -> handler"""
+    return {keyword.casefold(): handler for keywords, handler in groups for keyword in keywords}
+
+
+# Comandi "[comando] [argomenti]": prima parola -> handler(messaggio senza
+# spazi iniziali/finali, mittente)
+PREFIX_COMMANDS = {
+    'aggiungi': add_player_command,
+    'rimuovi': remove_player_command,
+    'stats': player_stats_command,
+}
+
+# Comandi esatti (normalizzati con casefold) -> handler(mittente), validi anche durante
+# una registrazione manuale
+COMMAND_HANDLERS = _command_table(
+    (('help', 'aiuto', 'comandi', 'start', 'ciao', 'hello'), lambda from_number: HELP_TEXT),
+    (('classifica', 'leaderboard', 'rankings', 'top', 'rank'), lambda from_number: balancer.get_leaderboard()),
+    (('inattesa', 'pending', 'partite'), lambda from_number: balancer.get_pending_games()),
+    (('storico', 'history', 'cronologia'), lambda from_number: balancer.get_game_history()),
+    (('registra', 'manual', 'manuale'), start_manual_game),
+)
+
+# Comandi esatti considerati solo fuori da una registrazione manuale
+IDLE_COMMAND_HANDLERS = _command_table(
+    (('squadre', 'teams', 'team', 'crea squadre'), lambda from_number: TEAMS_PROMPT),
+    (('risultato', 'score', 'result', 'punteggio'), score_prompt),
+)
+
+# Parole che annullano una registrazione manuale in corso
+CANCEL_KEYWORDS = frozenset({'annulla', 'cancel', 'esci'})
+
+
+def handle_message(incoming_message: str, from_number: str) -> str:
+    """Elabora messaggio WhatsApp in arrivo e restituisce risposta
+
+    Le modifiche non vengono salvate qui: ci pensa flush_balancer ogni
+    SAVE_INTERVAL_SECONDS.
+    """
+
+    stripped = incoming_message.strip()
+    message = stripped.casefold()
+
+    # Comandi con argomenti (aggiungi, rimuovi, stats)
+    command, sep, _ = message.partition(' ')
+    handler = PREFIX_COMMANDS.get(command) if sep else None
+    if handler:
+        return handler(stripped, from_number)
+
+    # Comandi esatti (aiuto, classifica, inattesa, storico, registra)
+    handler = COMMAND_HANDLERS.get(message)
+    if handler:
+        return handler(from_number)
 
     # Gestione sessione registrazione manuale
-    elif from_number in manual_game_sessions:
+    if from_number in manual_game_sessions:
         session = manual_game_sessions[from_number]
+        session['ts'] = time.monotonic()
 
         # Comando annulla
-        if message in ['annulla', 'cancel', 'esci']:
+        if message in CANCEL_KEYWORDS:
             del manual_game_sessions[from_number]
             return "❌ Registrazione annullata."
 
@@ -266,85 +592,58 @@ Inserisci il *risultato* (es. 5-3):
                     team1_score,
                     team2_score
                 )
-                # Salva dati
-                balancer.save_to_file()
                 # Pulisci sessione
                 del manual_game_sessions[from_number]
                 return result
             else:
                 return "❌ Formato risultato non valido.\n\nUsa: 5-3 oppure 3 2\n\nRiprova o scrivi *annulla* per uscire."
 
-    # Comando: Squadre (inizia selezione squadre)
-    elif message in ['squadre', 'teams', 'team', 'crea squadre']:
-        return """⚽ *MODALITÀ SELEZIONE SQUADRE*
-
-Inviami la lista di 10 partecipanti.
-
-*Opzioni formato:*
-1. Un nome per riga:
-Marco
-Luca
-Anna
-...
-
-2. Separati da virgola:
-Marco, Luca, Anna, Paolo, ...
-
-Invia la lista adesso! 👇
-"""
-    
-    # Comando: Risultato (inserimento punteggio)
-    elif message in ['risultato', 'score', 'result', 'punteggio']:
-        pending = balancer.get_pending_games()
-        if pending == "No pending games":
-            return "❌ Nessuna partita in attesa. Prima crea le squadre!"
-        return f"{pending}\n\n💡 Rispondi con il risultato:\n• Solo punteggio: 5-3\n• Con ID: 20240205_143022 5-3"
+    # Comandi esatti fuori sessione (squadre, risultato)
+    handler = IDLE_COMMAND_HANDLERS.get(message)
+    if handler:
+        return handler(from_number)
 
     # Prova a interpretare come lista partecipanti
-    elif '\n' in incoming_message or ',' in incoming_message:
+    if '\n' in incoming_message or ',' in incoming_message:
         names = balancer.parse_participant_list(incoming_message)
         if len(names) == 10:
             teams, response = balancer.create_teams(names)
             if teams:
-                balancer.save_to_file()
                 schedule_score_request(teams['game_id'], from_number)
                 response += "\n\n⏰ Ti chiederò il risultato domani!"
             return response
         elif len(names) > 0:
             return f"❌ Servono esattamente 10 giocatori, ne hai inseriti {len(names)}.\n\n👥 Invia esattamente 10 nomi per creare le squadre."
 
-    # Prova a interpretare come inserimento risultato
-    elif any(char in message for char in ['-', ' ']) and any(char.isdigit() for char in message):
-        words = incoming_message.split()
+    # Prova a interpretare come inserimento risultato (una sola regex sull'intero messaggio)
+    score = balancer.parse_score(stripped)
+    if score:
+        words = stripped.split()
 
         game_id = None
-        score_str = None
+        word_score = None
 
-        # Trova game_id e punteggio
+        # Trova game_id e punteggio, fermandosi appena li ha entrambi
         for word in words:
-            if '_' in word and len(word) > 10:
+            if game_id is None and GAME_ID_RE.fullmatch(word):
                 game_id = word
-            elif balancer.parse_score(word):
-                score_str = word
+                continue
+            if word_score is None:
+                word_score = balancer.parse_score(word)
+            if game_id and word_score:
+                break
 
         # Se c'è solo una partita in attesa, usa quella
-        if not game_id and len(balancer.pending_games) == 1:
-            game_id = list(balancer.pending_games.keys())[0]
+        single_id = next(iter(balancer.pending_games)) if len(balancer.pending_games) == 1 else None
+        if not game_id:
+            game_id = single_id
 
-        if game_id and score_str:
-            score = balancer.parse_score(score_str)
-            if score:
-                response = balancer.update_ratings(game_id, score[0], score[1])
-                balancer.save_to_file()
-                return response
+        if game_id and word_score:
+            return balancer.update_ratings(game_id, word_score[0], word_score[1])
 
         # Prova solo il punteggio se c'è una sola partita in attesa
-        score = balancer.parse_score(incoming_message)
-        if score and len(balancer.pending_games) == 1:
-            game_id = list(balancer.pending_games.keys())[0]
-            response = balancer.update_ratings(game_id, score[0], score[1])
-            balancer.save_to_file()
-            return response
+        if single_id:
+            return balancer.update_ratings(single_id, score[0], score[1])
 
         return "❌ Non riesco a interpretare il risultato.\n\n💡 Formato: 5-3 oppure 20240205_143022 5-3"
 
@@ -362,24 +661,20 @@ def webhook():
         token = request.args.get('hub.verify_token')
         challenge = request.args.get('hub.challenge')
 
-        print(f"🔍 Richiesta GET webhook:")
-        print(f"   mode: {mode}")
-        print(f"   token ricevuto: {token}")
-        print(f"   token atteso: {WEBHOOK_VERIFY_TOKEN}")
-        print(f"   challenge: {challenge}")
-        print(f"   token corrisponde: {token == WEBHOOK_VERIFY_TOKEN}")
+        log.debug("Verifica webhook: mode=%s challenge=%s token_corrisponde=%s",
+                  mode, challenge, token == WEBHOOK_VERIFY_TOKEN)
 
         if mode == 'subscribe' and token == WEBHOOK_VERIFY_TOKEN:
-            print("✅ Webhook verificato")
+            log.info("Webhook verificato")
             if challenge:
                 response = make_response(challenge, 200)
                 response.headers['Content-Type'] = 'text/plain'
                 return response
             else:
-                print("⚠️ Nessun challenge ricevuto")
+                log.warning("Nessun challenge ricevuto")
                 return 'OK', 200
         else:
-            print("❌ Verifica webhook fallita")
+            log.warning("Verifica webhook fallita")
             return 'Forbidden', 403
 
     elif request.method == 'POST':
@@ -390,11 +685,11 @@ def webhook():
             return jsonify({'status': 'error', 'message': 'Nessun dato'}), 400
 
         try:
-            # Estrai dati messaggio
-            entry = data.get('entry', [{}])[0]
-            changes = entry.get('changes', [{}])[0]
-            value = changes.get('value', {})
-            messages = value.get('messages', [])
+            # Estrai dati messaggio (le notifiche di stato non hanno 'messages')
+            entries = data.get('entry')
+            changes = entries and entries[0].get('changes')
+            value = changes and changes[0].get('value')
+            messages = value and value.get('messages')
 
             if not messages:
                 return jsonify({'status': 'nessun messaggio'}), 200
@@ -408,26 +703,63 @@ def webhook():
             if message_type == 'text':
                 text_body = message.get('text', {}).get('body', '')
 
-                # Segna come letto
-                mark_message_as_read(message_id)
-
-                # Elabora messaggio
-                response_text = handle_message(text_body, from_number)
-
-                # Invia risposta
-                send_whatsapp_message(from_number, response_text)
+                # Conferma di lettura sul pool, elaborazione e risposta in coda
+                executor.submit(mark_message_as_read, message_id)
+                incoming_queue.put((text_body, from_number))
+                return jsonify({'status': 'queued'}), 200
 
             return jsonify({'status': 'success'}), 200
 
         except Exception as e:
-            print(f"Errore elaborazione webhook: {e}")
+            log.exception("Errore elaborazione webhook")
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+# Distingue gli ETag di processi diversi (il contatore di stato riparte a ogni avvio)
+ETAG_PREFIX = f'{os.getpid()}-{int(time.time())}'
+
+
+def conditional_json(make_etag, build):
+    """Risponde 304 se il client ha già la versione corrente, altrimenti il JSON di build()
+
+    Il JSON e l'ETag che lo descrive vengono calcolati insieme sotto balancer_lock,
+    per non leggere il balancer mentre un'altra richiesta lo modifica.
+    """
+    etag = make_etag()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        with balancer_lock:
+            etag = make_etag()
+            response = jsonify(build())
+    response.set_etag(etag)
+    return response
+
+
+# Risposte JSON già codificate, valide finché lo stato del balancer non cambia
+_response_cache = {}  # chiave -> (generazione, corpo JSON)
+
+
+def cached_json(key: str, build):
+    """Restituisce il JSON di build(), ricalcolato solo dopo una modifica del balancer
+
+    Le letture in cache non prendono il lock, così le richieste della dashboard
+    procedono in parallelo; solo il ricalcolo lo prende, per non leggere il
+    balancer mentre un'altra richiesta lo modifica.
+    """
+    cached = _response_cache.get(key)
+    if cached is None or cached[0] != balancer.generation:
+        with balancer_lock:
+            generation = balancer.generation
+            body = app.json.dumps(build())
+        cached = _response_cache[key] = (generation, body)
+    return app.response_class(cached[1], mimetype='application/json')
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Endpoint controllo stato"""
-    return jsonify({
+    return conditional_json(lambda: f'{ETAG_PREFIX}-health-{balancer.generation}-{len(game_reminders)}', lambda: {
         'status': 'attivo',
         'giocatori': len(balancer.players),
         'partite_in_attesa': len(balancer.pending_games),
@@ -438,7 +770,7 @@ def health():
 @app.route('/stats', methods=['GET'])
 def stats():
     """Ottieni statistiche bot"""
-    return jsonify({
+    return conditional_json(lambda: f'{ETAG_PREFIX}-stats-{balancer.generation}-{len(game_reminders)}', lambda: {
         'giocatori_totali': len(balancer.players),
         'partite_in_attesa': len(balancer.pending_games),
         'promemoria_programmati': len(game_reminders),
@@ -448,7 +780,7 @@ def stats():
                 'elo': p.elo,
                 'partite': p.games_played
             }
-            for p in sorted(balancer.players.values(), key=lambda x: x.elo, reverse=True)[:5]
+            for p in balancer.get_top_players(5)
         ]
     })
 
@@ -469,10 +801,23 @@ def serve_static(filename):
     return send_from_directory('static', filename)
 
 
+def action_response(result: str, error_status: int = 400):
+    """Risposta JSON per un'azione del balancer (i suoi messaggi di errore iniziano con ❌)"""
+    success = not result.startswith('❌')
+    return jsonify({'message': result, 'success': success}), 200 if success else error_status
+
+
+def check_admin(password) -> bool:
+    """Verifica la password di amministrazione con un confronto a tempo costante"""
+    if not ADMIN_PASSWORD or not isinstance(password, str):
+        return False
+    return hmac.compare_digest(password.encode('utf-8'), ADMIN_PASSWORD.encode('utf-8'))
+
+
 @app.route('/api/players', methods=['GET'])
 def api_get_players():
     """Get all players sorted by ELO"""
-    return jsonify(balancer.get_players_data())
+    return cached_json('players', balancer.get_players_data)
 
 
 @app.route('/api/players/<name>', methods=['GET'])
@@ -494,48 +839,48 @@ def api_add_player():
     if not data or 'name' not in data:
         return jsonify({'error': 'Richiesto: name'}), 400
     vote = 6
-    result = balancer.add_player(data['name'], vote)
-    balancer.save_to_file()
-    success = result.startswith('✅')
-    return jsonify({'message': result, 'success': success}), 200 if success else 400
+    with balancer_lock:
+        result = balancer.add_player(data['name'], vote)
+    return action_response(result)
 
 
 @app.route('/api/players/<name>', methods=['DELETE'])
 def api_remove_player(name):
     """Remove a player (requires admin password)"""
     data = request.get_json() or {}
-    password = data.get('password', '')
-    if not ADMIN_PASSWORD or password != ADMIN_PASSWORD:
+    if not check_admin(data.get('password', '')):
         return jsonify({'error': 'Password errata', 'success': False}), 403
-    result = balancer.remove_player(name)
-    balancer.save_to_file()
-    success = result.startswith('✅')
-    return jsonify({'message': result, 'success': success}), 200 if success else 404
+    with balancer_lock:
+        result = balancer.remove_player(name)
+    return action_response(result, 404)
 
 
 @app.route('/api/games/pending', methods=['GET'])
 def api_pending_games():
     """Get pending games"""
-    return jsonify(balancer.get_pending_games_data())
+    return cached_json('pending_games', balancer.get_pending_games_data)
 
 
 @app.route('/api/games/pending/<game_id>', methods=['DELETE'])
 def api_delete_pending_game(game_id):
     """Delete a pending game (requires admin password)"""
     data = request.get_json() or {}
-    password = data.get('password', '')
-    if not ADMIN_PASSWORD or password != ADMIN_PASSWORD:
+    if not check_admin(data.get('password', '')):
         return jsonify({'error': 'Password errata', 'success': False}), 403
-    result = balancer.delete_pending_game(game_id)
-    balancer.save_to_file()
-    success = result.startswith('✅')
-    return jsonify({'message': result, 'success': success}), 200 if success else 404
+    with balancer_lock:
+        result = balancer.delete_pending_game(game_id)
+    return action_response(result, 404)
+
+
+# Tetto per ?limit= (la dashboard chiede l'intero storico con limit=1000)
+MAX_HISTORY_LIMIT = 1000
 
 
 @app.route('/api/games/history', methods=['GET'])
 def api_game_history():
     """Get game history"""
     limit = request.args.get('limit', 20, type=int)
+    limit = min(max(limit, 1), MAX_HISTORY_LIMIT)
     return jsonify(balancer.get_game_history_data(limit))
 
 
@@ -543,26 +888,22 @@ def api_game_history():
 def api_recalculate_elos():
     """Recalculate all ELOs from scratch by replaying full game history (requires admin password)"""
     data = request.get_json() or {}
-    password = data.get('password', '')
-    if not ADMIN_PASSWORD or password != ADMIN_PASSWORD:
+    if not check_admin(data.get('password', '')):
         return jsonify({'error': 'Password errata', 'success': False}), 403
-    result = balancer.recalculate_all_elos()
-    balancer.save_to_file()
-    success = result.startswith('✅')
-    return jsonify({'message': result, 'success': success}), 200 if success else 400
+    with balancer_lock:
+        result = balancer.recalculate_all_elos()
+    return action_response(result)
 
 
 @app.route('/api/games/history/<game_id>', methods=['DELETE'])
 def api_delete_game_from_history(game_id):
     """Delete a completed game from history and reverse ELO changes (requires admin password)"""
     data = request.get_json() or {}
-    password = data.get('password', '')
-    if not ADMIN_PASSWORD or password != ADMIN_PASSWORD:
+    if not check_admin(data.get('password', '')):
         return jsonify({'error': 'Password errata', 'success': False}), 403
-    result = balancer.delete_game_from_history(game_id)
-    balancer.save_to_file()
-    success = result.startswith('✅')
-    return jsonify({'message': result, 'success': success}), 200 if success else 400
+    with balancer_lock:
+        result = balancer.delete_game_from_history(game_id)
+    return action_response(result)
 
 
 @app.route('/api/games/propose-teams', methods=['POST'])
@@ -584,46 +925,57 @@ def api_confirm_teams():
     data = request.get_json()
     if not data or 'team1' not in data or 'team2' not in data:
         return jsonify({'error': 'Richiesti: team1, team2'}), 400
-    teams, message = balancer.confirm_teams(data['team1'], data['team2'])
+    with balancer_lock:
+        teams, message = balancer.confirm_teams(data['team1'], data['team2'])
     if teams:
-        balancer.save_to_file()
         return jsonify({'success': True, 'teams': teams, 'message': message})
     return jsonify({'success': False, 'message': message}), 400
 
 
+SCORE_FIELDS = ('team1_score', 'team2_score')
+SCORE_ERROR = f'I punteggi devono essere numeri tra 0 e {MAX_SCORE}'
+
+
+def has_fields(data, fields) -> bool:
+    """True se il corpo JSON è un oggetto che contiene tutti i campi richiesti"""
+    return isinstance(data, dict) and all(field in data for field in fields)
+
+
+def parse_scores(data: dict):
+    """Restituisce (team1_score, team2_score) come interi, o None se non sono numeri tra 0 e MAX_SCORE"""
+    try:
+        scores = int(data['team1_score']), int(data['team2_score'])
+    except (ValueError, TypeError):
+        return None
+    return scores if all(0 <= score <= MAX_SCORE for score in scores) else None
+
+
 @app.route('/api/games/record-score', methods=['POST'])
 def api_record_score():
     """Record score for a pending game"""
     data = request.get_json()
-    if not data or 'game_id' not in data or 'team1_score' not in data or 'team2_score' not in data:
+    if not has_fields(data, ('game_id',) + SCORE_FIELDS):
         return jsonify({'error': 'Richiesti: game_id, team1_score, team2_score'}), 400
-    try:
-        t1 = int(data['team1_score'])
-        t2 = int(data['team2_score'])
-    except (ValueError, TypeError):
-        return jsonify({'error': 'I punteggi devono essere numeri'}), 400
-    result = balancer.update_ratings(data['game_id'], t1, t2)
-    balancer.save_to_file()
-    success = not result.startswith('❌')
-    return jsonify({'message': result, 'success': success}), 200 if success else 400
+    scores = parse_scores(data)
+    if scores is None:
+        return jsonify({'error': SCORE_ERROR}), 400
+    with balancer_lock:
+        result = balancer.update_ratings(data['game_id'], *scores)
+    return action_response(result)
 
 
 @app.route('/api/games/manual', methods=['POST'])
 def api_manual_game():
     """Record a manual game"""
     data = request.get_json()
-    required = ['team1', 'team2', 'team1_score', 'team2_score']
-    if not data or not all(k in data for k in required):
-        return jsonify({'error': f'Richiesti: {", ".join(required)}'}), 400
-    try:
-        t1 = int(data['team1_score'])
-        t2 = int(data['team2_score'])
-    except (ValueError, TypeError):
-        return jsonify({'error': 'I punteggi devono essere numeri'}), 400
-    result = balancer.record_manual_game(data['team1'], data['team2'], t1, t2)
-    balancer.save_to_file()
-    success = not result.startswith('❌')
-    return jsonify({'message': result, 'success': success}), 200 if success else 400
+    if not has_fields(data, ('team1', 'team2') + SCORE_FIELDS):
+        return jsonify({'error': 'Richiesti: team1, team2, team1_score, team2_score'}), 400
+    scores = parse_scores(data)
+    if scores is None:
+        return jsonify({'error': SCORE_ERROR}), 400
+    with balancer_lock:
+        result = balancer.record_manual_game(data['team1'], data['team2'], *scores)
+    return action_response(result)
 
 
 if __name__ == '__main__':
@@ -641,6 +993,6 @@ if __name__ == '__main__':
     if not META_PHONE_NUMBER_ID:
         print("⚠️  ATTENZIONE: META_PHONE_NUMBER_ID non impostato!")
 
-    # Avvia app Flask
+    # Avvia app Flask (solo sviluppo: in produzione usare gunicorn, vedi docstring)
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)